@@ -0,0 +1,141 @@
+import numpy as np
+import argparse
+import csv
+import glob
+import os
+import time
+import multiprocessing
+
+from data import Data
+from minimiser import Minimiser
+
+"""This module runs the 1D and 2D fits, with their errors, over many lifetime files at once.
+Each file is loaded and fitted on a worker process, and one row per file is appended to a CSV results table as soon as it finishes.
+A file which fails is recorded with its error message without stopping the others, and a rerun skips the files already fitted and replaces the rows of those it tries again.
+
+Example:
+    python batch.py runs/ --output results.csv --processes 8"""
+
+
+COLUMNS = ['file', 'status', 'readings', 'nll1D', 'tau1D', 'tauParabError1D', 'tauPosError1D', 'tauNegError1D',
+           'nll2D', 'tau2D', 'a2D', 'tauError2D', 'aError2D', 'seconds', 'message']
+
+
+def findFiles(pattern):
+    """Returns the sorted lifetime files matching a glob pattern, or every .txt file if a directory is given."""
+
+    if os.path.isdir(pattern):
+        pattern = os.path.join(pattern, '*.txt')
+
+    return sorted(glob.glob(pattern))
+
+def fitFile(filename):
+    """Runs the full analysis on one file, returning a dictionary with a value for each results column."""
+
+    start = time.time()
+
+    times, errors = Data(filename, 'r').readData()
+    minim = Minimiser(times, errors, np.mean(errors))
+
+    #1D fit without background
+    tauMin, nllMin, x, y = minim.minimiseNll([0.3, 0.4, 0.5], 1e-5)
+    parabError = minim.parabError(x, y)
+    posError = minim.posError(tauMin, 1e-5, method='root', errorGuess=parabError)
+    negError = minim.negError(tauMin, 1e-5, method='root', errorGuess=parabError)
+
+    #2D fit with background, with errors from the inverse of the Hessian at the minimum
+    bkgNllMin, bkgTauMin, bkgAMin = minim.bkgNewtonMinimiseNll(0.4, 0.9)[:3]
+    hessian = minim.funcs.bkgNllDerivatives(bkgTauMin, bkgAMin)[2]
+    covariance = np.linalg.inv(hessian)
+
+    return {
+        'file': filename, 'status': 'ok', 'readings': len(times),
+        'nll1D': nllMin, 'tau1D': tauMin, 'tauParabError1D': parabError, 'tauPosError1D': posError, 'tauNegError1D': negError,
+        'nll2D': bkgNllMin, 'tau2D': bkgTauMin, 'a2D': bkgAMin,
+        'tauError2D': np.sqrt(covariance[0, 0]), 'aError2D': np.sqrt(covariance[1, 1]),
+        'seconds': time.time() - start, 'message': '',
+    }
+
+def _safeFitFile(filename):
+    """Fits one file, turning any failure into an error row so that one bad file cannot stop the batch."""
+
+    start = time.time()
+    try:
+        return fitFile(filename)
+    except Exception as error:
+        return {'file': filename, 'status': 'error', 'seconds': time.time() - start, 'message': '%s: %s' % (type(error).__name__, error)}
+
+def readTable(output):
+    """Returns the rows of an existing results table, keeping only the latest row for each file, in the order the files first appear."""
+
+    if not os.path.exists(output):
+        return {}
+
+    rows = {}
+    with open(output, 'r') as f:
+        for row in csv.DictReader(f):
+            rows[row['file']] = row #A later row for the same file supersedes the earlier one
+
+    return rows
+
+def finishedFiles(output):
+    """Returns the set of files already fitted successfully in an existing results table."""
+
+    return set(filename for filename, row in readTable(output).items() if row['status'] == 'ok')
+
+def runFiles(filenames, output, processes=None, resume=True):
+    """Fits every file on a pool of worker processes, appending each result to the output CSV as soon as it is available.
+    With resume, files already fitted successfully in the output are skipped, and failed files are tried again.
+    The table is first rewritten without the rows of the files about to be fitted, so it holds one row per file.
+    Returns the number of files fitted successfully and the number which failed."""
+
+    rows = readTable(output) if resume else {}
+    remaining = [filename for filename in filenames if rows.get(filename, {}).get('status') != 'ok']
+    retried = set(remaining)
+    kept = [row for filename, row in rows.items() if filename not in retried]
+
+    #The kept rows are written to a new file which then replaces the table, so an interrupted rewrite cannot lose them
+    temporary = output + '.tmp'
+    with open(temporary, 'w') as f:
+        writer = csv.DictWriter(f, COLUMNS, restval='', extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(kept)
+    os.rename(temporary, output)
+
+    succeeded = failed = 0
+
+    with open(output, 'a') as f:
+        writer = csv.DictWriter(f, COLUMNS, restval='')
+
+        pool = multiprocessing.Pool(processes)
+        try:
+            for row in pool.imap_unordered(_safeFitFile, remaining): #Rows are written in the order the files finish
+                writer.writerow(row)
+                f.flush()
+                if row['status'] == 'ok':
+                    succeeded += 1
+                else:
+                    failed += 1
+        finally:
+            pool.close()
+            pool.join()
+
+    return succeeded, failed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Fit many lifetime files and collect the results in one table.')
+    parser.add_argument('files', help='directory of .txt files, or a glob pattern such as "runs/*/lifetime*.txt"')
+    parser.add_argument('--output', default='results.csv', help='CSV results table, appended to as files finish')
+    parser.add_argument('--processes', type=int, default=None, help='worker processes (default: one per CPU)')
+    parser.add_argument('--no-resume', action='store_true', help='refit every file and start a new results table')
+    args = parser.parse_args(argv)
+
+    filenames = findFiles(args.files)
+    succeeded, failed = runFiles(filenames, args.output, args.processes, not args.no_resume)
+    print('%d files fitted, %d failed, %d skipped as already fitted' % (succeeded, failed, len(filenames) - succeeded - failed))
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
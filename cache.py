@@ -0,0 +1,195 @@
+import numpy as np
+import hashlib
+import os
+
+"""This module stores analysis results on disk so that rerunning an unchanged analysis does not recompute them.
+Results are keyed by the content of the data file together with the name and arguments of the calculation and the source of the modules which calculate them, and saved in numpy's compact .npz format.
+Editing eg. functions.py or minimiser.py therefore makes the old results unreachable, and they are removed as the cache reaches its size limit.
+The cache is kept below a size limit by deleting the least recently used results first."""
+
+
+CODE_FILES = ('data.py', 'functions.py', 'minimiser.py', 'surface.py') #Modules whose source changes the cached results
+
+
+class ResultCache(object):
+
+    """An on-disk cache of minimiser results and NLL grids for data files."""
+
+    def __init__(self, directory='.nllcache', maxBytes=256*2**20):
+        self.directory = directory
+        self.maxBytes = maxBytes
+        self._hashes = {} #Content hashes of data files, keyed by path, size and modification time
+        self.codeHash = codeHash()
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def dataHash(self, filename):
+        """Returns a hash of the contents of a data file. It is only recalculated when the file's size or modification time change."""
+
+        stat = os.stat(filename)
+        identity = (os.path.abspath(filename), stat.st_size, stat.st_mtime)
+
+        if identity not in self._hashes:
+            digest = hashlib.sha1()
+            with open(filename, 'rb') as f:
+                for block in iter(lambda: f.read(2**20), b''):
+                    digest.update(block)
+            self._hashes[identity] = digest.hexdigest()
+
+        return self._hashes[identity]
+
+    def key(self, filename, name, args):
+        """Returns the cache key for a named calculation with the given arguments on a data file."""
+
+        digest = hashlib.sha1(self.codeHash.encode('utf-8'))
+        digest.update(name.encode('utf-8'))
+        _addToDigest(digest, args)
+
+        return self.dataHash(filename)[:16] + '-' + digest.hexdigest() #Starting with the data hash, so the results for one file can be found and invalidated
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.npz')
+
+    def get(self, key):
+        """Returns the cached result for a key, or None if it is not cached."""
+
+        path = self._path(key)
+        try:
+            with np.load(path) as stored:
+                values = tuple(_fromStored(stored['arr_%d' % i]) for i in range(int(stored['count'])))
+                single = bool(stored['single'])
+            os.utime(path, None) #Marking the result as recently used
+        except (IOError, OSError, ValueError, KeyError):
+            return None
+
+        return values[0] if single else values
+
+    def put(self, key, result):
+        """Stores a result (a number, array or list, or a tuple of these) for a key, then evicts old results if the cache is over its size limit."""
+
+        single = not isinstance(result, tuple)
+        values = (result,) if single else result
+
+        path = self._path(key)
+        temporary = path[:-len('.npz')] + '.tmp.npz'
+        np.savez(temporary, count=len(values), single=single, *[np.asarray(value) for value in values])
+        os.rename(temporary, path) #Replacing the result in one step, so a partly written file is never read
+
+        self.evict()
+
+    def cached(self, filename, name, args, compute):
+        """Returns the cached result of a named calculation on a data file, calling compute() and storing its result if it is not cached."""
+
+        key = self.key(filename, name, args)
+        result = self.get(key)
+
+        if result is None:
+            result = compute()
+            self.put(key, result)
+
+        return result
+
+    def wrap(self, filename, name, function):
+        """Returns a version of function whose results are cached, keyed by the data file, the name and the arguments of each call.
+        For example cache.wrap('lifetime.txt', 'bkgNllGrid', funcs.bkgNllGrid) caches every NLL grid evaluated through it."""
+
+        def cachedFunction(*args, **kwargs):
+            return self.cached(filename, name, (args, kwargs), lambda: function(*args, **kwargs))
+
+        return cachedFunction
+
+    def _stats(self):
+        """Returns (path, last use, size) for every cached result, least recently used first, skipping any deleted meanwhile by another thread or process."""
+
+        stats = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.npz') and '.tmp' not in name:
+                path = os.path.join(self.directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                stats.append((path, stat.st_mtime, stat.st_size))
+
+        return sorted(stats, key=lambda entry: entry[1])
+
+    def entries(self):
+        """Returns the paths of all cached results, least recently used first."""
+
+        return [path for path, used, size in self._stats()]
+
+    def size(self):
+        """Returns the total size of the cached results in bytes."""
+
+        return sum(size for path, used, size in self._stats())
+
+    def evict(self):
+        """Deletes the least recently used results until the cache is within its size limit."""
+
+        stats = self._stats()
+        total = sum(size for path, used, size in stats)
+
+        for path, used, size in stats:
+            if total <= self.maxBytes:
+                break
+            total -= size
+            _remove(path)
+
+    def invalidate(self, filename=None):
+        """Deletes every cached result for a data file, or the whole cache if no file is given."""
+
+        prefix = '' if filename is None else self.dataHash(filename)[:16] + '-'
+
+        for path in self.entries():
+            if os.path.basename(path).startswith(prefix):
+                _remove(path)
+
+
+def codeHash(files=CODE_FILES):
+    """Returns a hash of the source of the analysis modules, found next to this one."""
+
+    digest = hashlib.sha1()
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for name in files:
+        with open(os.path.join(directory, name), 'rb') as f:
+            digest.update(f.read())
+
+    return digest.hexdigest()
+
+def _addToDigest(digest, value):
+    """Adds a description of an argument (a number, string, array or a list, tuple or dictionary of these) to a hash."""
+
+    if isinstance(value, dict):
+        digest.update(b'{')
+        for key in sorted(value):
+            _addToDigest(digest, key)
+            _addToDigest(digest, value[key])
+        digest.update(b'}')
+    elif isinstance(value, (list, tuple)):
+        digest.update(b'[')
+        for item in value:
+            _addToDigest(digest, item)
+        digest.update(b']')
+    elif isinstance(value, np.ndarray):
+        digest.update(('array%s%s' % (value.dtype.str, value.shape)).encode('utf-8'))
+        digest.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, (float, np.floating)):
+        digest.update(repr(float(value)).encode('utf-8')) #So that equal numpy and Python numbers give the same key
+    elif isinstance(value, (int, np.integer)) and not isinstance(value, bool):
+        digest.update(repr(int(value)).encode('utf-8'))
+    else:
+        digest.update(repr(value).encode('utf-8'))
+
+def _fromStored(array):
+    """Converts a stored array back to a number if it holds a single value."""
+
+    return array.item() if array.ndim == 0 else array
+
+def _remove(path):
+    """Deletes a cached result, unless it has already been deleted by another thread or process."""
+
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -0,0 +1,259 @@
+import numpy as np
+import argparse
+import json
+import os
+import sys
+
+from data import Data
+from minimiser import Minimiser
+from functions import BinnedFunctions
+from cache import ResultCache
+from surface import NllSurface
+from follow import LiveFitter
+
+"""This module is a command line interface for running the analysis without a display.
+Each stage of main.py is a subcommand, and its results are printed as JSON.
+matplotlib is only imported when plots are requested with --plot-dir, and the figures are then saved there using the non-interactive Agg backend.
+
+Examples:
+    python cli.py fit1d
+    python cli.py fit2d --data runs/run7.txt --plot-dir plots
+    python cli.py errors --method2d profile
+    python cli.py subsets --processes 4 --warm-start --cache-dir .nllcache
+    python cli.py follow --data live.txt --binned --interval 5"""
+
+
+def loadMinimiser(args):
+    """Reads the data file and creates the Minimiser used by every subcommand."""
+
+    times, errors = Data(args.data, 'r', np.float32 if args.compact else float).readData()
+
+    if args.binned:
+        return Minimiser(times, errors, np.mean(errors), funcs=BinnedFunctions(times, errors, np.mean(errors), args.time_bins, args.error_bins))
+
+    return Minimiser(times, errors, np.mean(errors), workers=args.workers)
+
+def cached(args, name, function):
+    """Returns function with its results cached on disk for the data file if --cache-dir was given, otherwise function itself."""
+
+    if args.cache_dir is None:
+        return function
+
+    if args.binned: #Results of each mode are kept apart, as they differ slightly
+        name += '-binned%dx%d' % (args.time_bins, args.error_bins)
+    if args.compact:
+        name += '-float32'
+
+    return ResultCache(args.cache_dir, int(args.cache_size*2**20)).wrap(args.data, name, function)
+
+def loadPlotting(args):
+    """Imports the plotting module with the non-interactive backend, or returns None if no plots were requested."""
+
+    if args.plot_dir is None:
+        return None
+
+    import matplotlib
+    matplotlib.use('Agg') #Rendering straight to files, so no display is needed
+    import plotting as pt
+
+    if not os.path.isdir(args.plot_dir):
+        os.makedirs(args.plot_dir)
+
+    return pt
+
+def plotFile(args, name):
+    """Returns the path a named figure is saved to."""
+
+    return os.path.join(args.plot_dir, name + '.' + args.plot_format)
+
+def fit1d(args):
+    """Minimises the 1D NLL without background."""
+
+    with loadMinimiser(args) as minim:
+        tauMin, nllMin, x, y = cached(args, 'minimiseNll', minim.minimiseNll)([0.3, 0.4, 0.5], args.tol)
+        results = {'tau': tauMin, 'nll': nllMin, 'parabError': minim.parabError(x, y)}
+
+        pt = loadPlotting(args)
+        if pt is not None:
+            taus = np.linspace(tauMin - 0.1, tauMin + 0.1, 100)
+            pt.plotNLL(taus, [minim.funcs.nll(tau) for tau in taus], tauMin, nllMin, filename=plotFile(args, 'nll'))
+
+        return results
+
+def fit2d(args):
+    """Minimises the 2D NLL with background using the Newton method."""
+
+    with loadMinimiser(args) as minim:
+        nllMin, tauMin, aMin, iterations, evaluations = cached(args, 'bkgNewtonMinimiseNll', minim.bkgNewtonMinimiseNll)(args.tau_start, args.a_start, args.tol)
+        results = {'tau': tauMin, 'a': aMin, 'nll': nllMin, 'iterations': iterations, 'evaluations': evaluations,
+                   'backgroundReadings': int(np.round((1 - aMin)*len(minim.times)))}
+        if args.binned:
+            results['binningAccuracy'] = minim.funcs.accuracy(tauMin, aMin) #Shifts of tau and a caused by binning, next to their statistical errors
+
+        pt = loadPlotting(args)
+        if pt is not None:
+            bkgTaus = np.linspace(tauMin - 0.05, tauMin + 0.05, 100)
+            bkgAs = np.linspace(aMin - 0.05, 0.999, 100)
+            bkgSurface = NllSurface(bkgTaus, bkgAs, cached(args, 'bkgNllGrid', minim.funcs.bkgNllGrid))
+            pt.plotContour(bkgSurface, levels=np.arange(nllMin+0.5, nllMin+0.5+100, 10), filename=plotFile(args, 'contour'))
+            pt.plot3D(bkgSurface, filename=plotFile(args, '3d'))
+
+            sortedTimes = np.sort(minim.times)
+            pdfs = [minim.funcs.fitFunction(tauMin, sortedTimes, minim.sigma), minim.funcs.bkgFitFunction(tauMin, aMin, sortedTimes, minim.sigma)]
+            pt.plotHist(minim.times, bins=100, sortedTimes=sortedTimes, pdfs=pdfs, filename=plotFile(args, 'hist'))
+
+        return results
+
+def errors(args):
+    """Calculates the errors of both the 1D and 2D fits."""
+
+    with loadMinimiser(args) as minim:
+        tauMin, nllMin, x, y = cached(args, 'minimiseNll', minim.minimiseNll)([0.3, 0.4, 0.5], args.tol)
+        parabError = minim.parabError(x, y)
+        posError = cached(args, 'posError', minim.posError)(tauMin, args.tol, method=args.method1d, errorGuess=parabError)
+        negError = cached(args, 'negError', minim.negError)(tauMin, args.tol, method=args.method1d, errorGuess=parabError)
+
+        bkgNllMin, bkgTauMin, bkgAMin = cached(args, 'bkgNewtonMinimiseNll', minim.bkgNewtonMinimiseNll)(args.tau_start, args.a_start)[:3]
+        if args.method2d == 'grid':
+            bkgTaus = np.linspace(bkgTauMin - 0.05, bkgTauMin + 0.05, 100)
+            bkgAs = np.linspace(bkgAMin - 0.05, 0.999, 100)
+            bkgSurface = NllSurface(bkgTaus, bkgAs, cached(args, 'bkgNllGrid', minim.funcs.bkgNllGrid))
+            errors2d = minim.bkgError(bkgSurface, tauMin=bkgTauMin, aMin=bkgAMin, funcMin=bkgNllMin)
+        else:
+            errors2d = cached(args, 'bkgContourError', minim.bkgContourError)(bkgTauMin, bkgAMin, bkgNllMin, method=args.method2d)
+
+        return {
+            'fit1d': {'tau': tauMin, 'posError': posError, 'negError': negError, 'parabError': parabError},
+            'fit2d': {'tau': bkgTauMin, 'a': bkgAMin, 'posTauError': errors2d[0], 'negTauError': errors2d[1], 'posAError': errors2d[2], 'negAError': errors2d[3]},
+        }
+
+def scan(args):
+    """Evaluates the 1D NLL over a range of tau values around the minimum."""
+
+    with loadMinimiser(args) as minim:
+        tauMin, nllMin = cached(args, 'minimiseNll', minim.minimiseNll)([0.3, 0.4, 0.5], args.tol)[:2]
+        taus = np.linspace(tauMin - args.width, tauMin + args.width, args.points)
+        likelihoods = cached(args, 'nllScan', lambda taus: np.array([minim.funcs.nll(tau) for tau in taus]))(taus)
+
+        pt = loadPlotting(args)
+        if pt is not None:
+            pt.plotNLL(taus, likelihoods, tauMin, nllMin, filename=plotFile(args, 'nll'))
+
+        return {'tauMin': tauMin, 'nllMin': nllMin, 'taus': taus, 'nll': likelihoods}
+
+def subsets(args):
+    """Calculates the error in tau against the number of readings used."""
+
+    with loadMinimiser(args) as minim:
+        sizes, sizeErrors = cached(args, 'errorVSReadings', minim.errorVSReadings)(args.lower, args.upper, args.step, args.processes, args.warm_start)
+        results = {'sizes': sizes, 'errors': sizeErrors}
+
+        pt = loadPlotting(args)
+        if pt is not None:
+            intersect, m, c = pt.plotErrorsVSReadings(sizes, sizeErrors, filename=plotFile(args, 'errors_vs_readings'))
+            results.update(gradient=m, intercept=c, readingsRequired=int(10**intersect[0]))
+
+        return results
+
+def follow(args):
+    """Refits the data file whenever readings are appended to it, printing each set of results as one line of JSON."""
+
+    fitter = LiveFitter(args.data, args.tol, args.binned, args.time_bins, args.error_bins, dtype=np.float32 if args.compact else float, workers=args.workers)
+
+    def emit(results):
+        sys.stdout.write(json.dumps(jsonReady(results), sort_keys=True) + '\n')
+        sys.stdout.flush()
+
+    if args.complete: #The file has been completely written, so it is fitted once
+        results = fitter.update(final=True)
+        if results is not None:
+            emit(results)
+        return None
+
+    try:
+        fitter.follow(args.interval, args.min_readings, args.updates, emit)
+    except KeyboardInterrupt: #Following is normally ended with Ctrl-C, once the run has finished
+        results = fitter.update(final=True) #Fitting any readings left, including a last line without a newline
+        if results is not None:
+            emit(results)
+
+    return None
+
+def jsonReady(value):
+    """Converts numpy values (and containers of them) into plain Python types for JSON output."""
+
+    if isinstance(value, dict):
+        return dict((key, jsonReady(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return [jsonReady(item) for item in value]
+    if isinstance(value, np.integer):
+        return int(value)
+    if isinstance(value, np.floating):
+        return float(value)
+    return value
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Fit the D0 lifetime data without a display.')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--data', default='lifetime.txt', help='lifetime data file')
+    common.add_argument('--tol', type=float, default=1e-5, help='tolerance of the minimisers and errors')
+    common.add_argument('--workers', type=int, default=1, help='threads used for each NLL evaluation')
+    common.add_argument('--plot-dir', help='save the figures for this subcommand into this directory')
+    common.add_argument('--plot-format', default='png', help='file format of saved figures')
+    common.add_argument('--binned', action='store_true', help='fit the readings histogrammed in (time, error) bins, which is much faster for millions of readings')
+    common.add_argument('--time-bins', type=int, default=2000, help='number of time bins with --binned')
+    common.add_argument('--error-bins', type=int, default=200, help='number of error bins with --binned')
+    common.add_argument('--compact', action='store_true', help='hold the readings in float32, halving their memory, with the NLL sums still accumulated in float64')
+    common.add_argument('--cache-dir', help='reuse results stored in this directory while the data file is unchanged')
+    common.add_argument('--cache-size', type=float, default=256, help='size limit of the cache in MB, beyond which the least recently used results are deleted')
+    common.add_argument('--clear-cache', action='store_true', help='delete the cached results for the data file before running')
+
+    start2d = argparse.ArgumentParser(add_help=False)
+    start2d.add_argument('--tau-start', type=float, default=0.4)
+    start2d.add_argument('--a-start', type=float, default=0.9)
+
+    subparsers.add_parser('fit1d', parents=[common], help='1D fit without background').set_defaults(run=fit1d)
+    subparsers.add_parser('fit2d', parents=[common, start2d], help='2D fit with background').set_defaults(run=fit2d)
+
+    errorParser = subparsers.add_parser('errors', parents=[common, start2d], help='errors of the 1D and 2D fits')
+    errorParser.add_argument('--method1d', choices=['root', 'scan'], default='root')
+    errorParser.add_argument('--method2d', choices=['rays', 'profile', 'hessian', 'grid'], default='rays')
+    errorParser.set_defaults(run=errors)
+
+    scanParser = subparsers.add_parser('scan', parents=[common], help='1D NLL against tau')
+    scanParser.add_argument('--width', type=float, default=0.1, help='range of tau either side of the minimum')
+    scanParser.add_argument('--points', type=int, default=100)
+    scanParser.set_defaults(run=scan)
+
+    subsetParser = subparsers.add_parser('subsets', parents=[common], help='error in tau against number of readings')
+    subsetParser.add_argument('--lower', type=int, default=1000)
+    subsetParser.add_argument('--upper', type=int, default=10000)
+    subsetParser.add_argument('--step', type=int, default=100)
+    subsetParser.add_argument('--processes', type=int, default=1)
+    subsetParser.add_argument('--warm-start', action='store_true')
+    subsetParser.set_defaults(run=subsets)
+
+    followParser = subparsers.add_parser('follow', parents=[common], help='refit the data file as readings are appended to it')
+    followParser.add_argument('--interval', type=float, default=1., help='seconds between checks for new readings')
+    followParser.add_argument('--min-readings', type=int, default=1, help='new readings needed before refitting')
+    followParser.add_argument('--updates', type=int, help='stop after this many fits (default: follow until interrupted)')
+    followParser.add_argument('--complete', action='store_true', help='the data file has been completely written: fit it once, including a last line without a newline, and stop')
+    followParser.set_defaults(run=follow)
+
+    args = parser.parse_args(argv)
+    if args.clear_cache and args.cache_dir is not None:
+        ResultCache(args.cache_dir).invalidate(args.data)
+
+    results = args.run(args)
+    if results is not None: #Subcommands which stream their own output return None
+        json.dump(jsonReady(results), sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
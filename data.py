@@ -1,40 +1,134 @@
 import numpy as np
+import os
+import json
+from itertools import islice
 
 class Data(object):
-    
-    """A class solely for extracting data from text files."""
-    
-    def __init__(self, filename, mode):
+
+    """A class solely for extracting data from text files.
+    Parsed data is kept in a binary cache next to the text file, so later reads can memory-map it instead of parsing again.
+    With dtype=np.float32 the times and errors are stored and returned in single precision (with a cache of their own), halving their memory use. Functions then works in float32 too."""
+
+    def __init__(self, filename, mode, dtype=float):
         self.filename = filename
         self.mode = mode
-        
-    def readData(self, size=None):
-        """Reads the input text file and extracts the data in the form of arrays."""
-    
+        self.dtype = np.dtype(dtype)
+        suffix = '' if self.dtype == np.float64 else '.' + self.dtype.name #Each precision has its own cache
+        self.cacheFile = filename + suffix + '.cache.npy' #Binary copy of the parsed columns, stored as a (2, readings) array
+        self.cacheInfo = filename + suffix + '.cache.json' #Size and modification time of the text file when the cache was written
+
+    def readData(self, size=None, cache=True):
+        """Reads the input text file and extracts the data in the form of arrays.
+        If cache is True, the memory-mapped binary cache is used whenever the text file is unchanged, and is rebuilt otherwise.
+        A size limit is then served as a slice of the cached columns, and the times and errors returned are views rather than copies."""
+
+        if cache:
+            columns = self._loadCache()
+            if columns is None and self._writeCache(): #Parsing the whole file once and storing the result for future reads
+                columns = self._loadCache()
+            if columns is None: #Falling back to parsing in memory if the cache cannot be written
+                columns = self._parse()
+        else:
+            columns = self._parse(size)
+
+        if size is not None: #If size is specified, a limited amount of time and error values are extracted
+            columns = columns[:, :size]
+
+        return columns[0], columns[1] #Returning these arrays to be used elsewhere
+
+    def _parse(self, size=None):
+        """Parses the text file (or its first size lines) into a (2, readings) array of times and errors in one vectorised pass."""
+
         with open(self.filename, self.mode) as f: #Opening the file so it can be interpreted
-            
-            data = f.readlines() #Scanning all distinct lines in the file
-    
-            times = []
-            errors = []
-            
-            if size is None: #If no size is specified, all the time and error values are extracted
-                for line in data:
-                    measurement = line.split()
-                    times.append(float(measurement[0])) 
-                    errors.append(float(measurement[1]))
-            else:
-                for line in data: #If size is specified, a limited amount of time and error values are extracted
-                    if len(times) < size:
-                            measurement = line.split()
-                            times.append(float(measurement[0]))
-                            errors.append(float(measurement[1]))
-                            
-                    else:
-                        break
-            
-            #Converting the time and error lists into numpy arrays for easier manipulation in the future
-            times = np.asarray(times)
-            errors = np.asarray(errors)
-            
-            return times, errors #Returning these arrays to be used elsewhere
\ No newline at end of file
+            text = f.read() if size is None else ''.join(islice(f, size))
+
+        return self._columns(text).astype(self.dtype, order='C') #Storing each column contiguously, rather than keeping the interleaved strides of the transposed view
+
+    def _columns(self, text):
+        """Converts a block of lines into a (2, readings) view of times and errors."""
+
+        values = np.fromstring(text, dtype=float, sep=' ') #Splitting on all whitespace, so each line gives a time and an error
+
+        if values.size % 2:
+            raise ValueError("%s does not contain a time and an error on every line" % self.filename)
+
+        return values.reshape(-1, 2).T
+
+    def _fileInfo(self):
+        """Returns the size and modification time of the text file, which identify whether the cache is still valid."""
+
+        stat = os.stat(self.filename)
+
+        return {'size': stat.st_size, 'mtime': stat.st_mtime}
+
+    def _loadCache(self):
+        """Memory-maps the cached columns if they match the current text file, otherwise returns None."""
+
+        try:
+            with open(self.cacheInfo, 'r') as f:
+                info = json.load(f)
+            if info != self._fileInfo():
+                return None
+            return np.load(self.cacheFile, mmap_mode='r')
+        except (IOError, OSError, ValueError):
+            return None
+
+    def _writeCache(self, blockLines=1000000):
+        """Parses the text file into the cache files, blockLines lines at a time, so files larger than memory can be cached.
+        Returns False if the cache cannot be written, eg. in a read-only directory."""
+
+        temporary = self.cacheFile + '.tmp'
+        try:
+            with open(self.filename, self.mode) as f: #First pass counts the readings so the cache can be allocated on disk
+                readings = sum(1 for line in f if line.strip())
+
+            columns = np.lib.format.open_memmap(temporary, mode='w+', dtype=self.dtype, shape=(2, readings))
+            filled = 0
+            with open(self.filename, self.mode) as f: #Second pass parses each block of lines straight into the cache
+                block = ''.join(islice(f, blockLines))
+                while block:
+                    values = self._columns(block)
+                    columns[:, filled:filled + values.shape[1]] = values
+                    filled += values.shape[1]
+                    block = ''.join(islice(f, blockLines))
+            columns.flush()
+            del columns
+
+            if filled != readings:
+                raise ValueError("%s does not contain a time and an error on every line" % self.filename)
+
+            if os.path.exists(self.cacheFile):
+                os.remove(self.cacheFile)
+            os.rename(temporary, self.cacheFile) #Replacing the cache in one step, so a partly written file is never read
+            with open(self.cacheInfo, 'w') as f:
+                json.dump(self._fileInfo(), f)
+            return True
+        except (IOError, OSError):
+            return False
+        finally:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+
+
+def generateData(size, tau=0.4, a=0.98, sigma=0.28, sigmaSpread=0.1, seed=None, errors=None):
+    """Generates synthetic decay times and errors following the PDF with background (equation (6) in submitted report).
+    A fraction a of the readings are exponential decays with mean lifetime tau, and the rest are background at zero time.
+    Every reading is then smeared by a Gaussian with its own error, drawn around sigma with a spread of sigmaSpread.
+    If an array of errors is given, these are used instead (and size is ignored). The seed may also be a numpy RandomState."""
+
+    random = seed if isinstance(seed, np.random.RandomState) else np.random.RandomState(seed)
+
+    if errors is None:
+        errors = np.abs(random.normal(sigma, sigmaSpread, size)) #Errors must be positive
+        errors = np.maximum(errors, 1e-3)
+    size = np.shape(errors)
+
+    signal = random.uniform(size=size) < a #Deciding which readings are genuine decays
+    times = np.where(signal, random.exponential(tau, size), 0.) + random.normal(0., errors) #Adding the resolution smearing
+
+    return times, errors
+
+def writeData(filename, times, errors):
+    """Writes times and errors to a text file in the same format as lifetime.txt, so it can be read with Data."""
+
+    np.savetxt(filename, np.column_stack([times, errors]), fmt='%g')
\ No newline at end of file
@@ -0,0 +1,189 @@
+import numpy as np
+import os
+import time
+
+from data import Data
+from functions import BinnedFunctions, ReadingHistogram
+from minimiser import Minimiser
+
+"""This module fits a lifetime file while readings are still being appended to it.
+Only the bytes added since the last read are parsed, and the readings are appended to arrays with spare capacity rather than reallocated each time.
+Every update refits tau (without background) and tau and a (with background), starting from the previous minima, and returns the new values with their errors.
+In binned mode the new readings are also added to a fixed (time, error) histogram, so the time taken by an update depends on the new readings and the number of bins rather than on the size of the file."""
+
+
+class GrowingColumns(object):
+
+    """Times and errors held in an array with spare capacity, which doubles whenever it is full, so appending n readings costs O(n) on average."""
+
+    def __init__(self, capacity=1024, dtype=float):
+        self._columns = np.empty((2, capacity), dtype=dtype)
+        self.size = 0
+
+    def extend(self, columns):
+        """Appends a (2, readings) array of times and errors."""
+
+        needed = self.size + columns.shape[1]
+        if needed > self._columns.shape[1]: #Doubling the capacity until the new readings fit
+            capacity = self._columns.shape[1]
+            while capacity < needed:
+                capacity *= 2
+            grown = np.empty((2, capacity), dtype=self._columns.dtype)
+            grown[:, :self.size] = self._columns[:, :self.size]
+            self._columns = grown
+
+        self._columns[:, self.size:needed] = columns
+        self.size = needed
+
+    @property
+    def times(self):
+        return self._columns[0, :self.size] #Views of the filled part, valid until the next extend
+
+    @property
+    def errors(self):
+        return self._columns[1, :self.size]
+
+
+class FileTail(object):
+
+    """Reads the readings appended to a lifetime text file since the previous read.
+    A last line without a newline is held back, however long it stays unchanged, as it may still be being written.
+    It is only parsed by a final read, made once the writer has finished (eg. for lifetime.txt, which does not end with a newline)."""
+
+    def __init__(self, filename):
+        self.data = Data(filename, 'r') #Used for converting lines of text into columns
+        self.filename = filename
+        self.reset()
+
+    def reset(self):
+        """Starts reading from the beginning of the file again."""
+
+        self.offset = 0
+        self._partial = b'' #An incomplete last line, kept until the rest of it is written
+
+    def truncated(self):
+        """Returns whether the file is now shorter than the part already read, eg. because it was replaced by a new run."""
+
+        return os.path.getsize(self.filename) < self.offset
+
+    def read(self, final=False):
+        """Returns a (2, readings) array of the complete lines appended since the last read.
+        With final, a last line without a newline is taken as complete too."""
+
+        with open(self.filename, 'rb') as f:
+            f.seek(self.offset)
+            block = f.read()
+        self.offset += len(block)
+
+        text = self._partial + block
+        end = len(text) if final else text.rfind(b'\n') + 1 #Only complete lines are parsed
+        self._partial = text[end:]
+
+        return self.data._columns(text[:end].decode('ascii'))
+
+
+class LiveFitter(object):
+
+    """Refits a lifetime file each time readings are appended to it, warm-starting every fit from the previous minima."""
+
+    def __init__(self, filename, tol=1e-5, binned=False, timeBins=2000, errorBins=200, timeRange=None, errorRange=None, dtype=float, workers=1):
+        """In binned mode the histogram covers timeRange and errorRange, or by default the range of the first readings widened by half of it on each side.
+        The readings are held with the given dtype (eg. np.float32 for the compact mode of Functions), and unbinned fits use the given number of worker threads."""
+
+        self.tail = FileTail(filename)
+        self.tol = tol
+        self.binned = binned
+        self.timeBins = timeBins
+        self.errorBins = errorBins
+        self.timeRange = timeRange
+        self.errorRange = errorRange
+        self.dtype = dtype
+        self.workers = workers
+        self.reset()
+
+    def reset(self):
+        """Forgets all readings and previous minima, so the file is refitted from its beginning."""
+
+        self.tail.reset()
+        self.columns = GrowingColumns(dtype=self.dtype)
+        self.histogram = None
+        self.minima = None #(tau without background, its parabolic error, tau and a with background) of the last fit
+        self.pending = 0 #Readings added since the last fit
+
+    def _addToHistogram(self, columns):
+        """Adds new readings to the histogram used in binned mode, creating it from the first readings."""
+
+        if self.histogram is None:
+            edges = []
+            for values, fixed, bins in [(columns[0], self.timeRange, self.timeBins), (columns[1], self.errorRange, self.errorBins)]:
+                lower, upper = fixed if fixed is not None else (np.min(values), np.max(values))
+                if fixed is None: #Leaving room for later readings beyond the range of the first ones
+                    lower, upper = lower - 0.5*(upper - lower), upper + 0.5*(upper - lower)
+                edges.append(np.linspace(lower, upper, bins + 1))
+            self.histogram = ReadingHistogram(edges[0], edges[1])
+
+        self.histogram.add(columns[0], columns[1])
+
+    def update(self, minReadings=1, final=False):
+        """Reads any readings appended since the last update and refits if there are at least minReadings of them.
+        A final update, made once the file has been completely written, also reads a last line without a newline and refits for any readings not yet fitted.
+        Returns a dictionary of the new fit results, or None if there was nothing to fit."""
+
+        start = time.time()
+
+        if self.tail.truncated():
+            self.reset()
+
+        columns = self.tail.read(final)
+        if columns.shape[1] > 0:
+            self.columns.extend(columns)
+            if self.binned:
+                self._addToHistogram(columns)
+            self.pending += columns.shape[1]
+
+        if self.pending < (1 if final else max(minReadings, 1)) or self.columns.size < 2:
+            return None
+        newReadings, self.pending = self.pending, 0
+
+        times, errors = self.columns.times, self.columns.errors
+        sigma = np.mean(errors)
+        funcs = BinnedFunctions(times, errors, sigma, histogram=self.histogram) if self.binned else None
+        with Minimiser(times, errors, sigma, funcs=funcs, workers=self.workers) as minim: #Closing the thread pool of each fit with workers > 1
+
+            #1D fit without background, with its parabola starting around the previous minimum
+            if self.minima is None:
+                x = [0.3, 0.4, 0.5]
+            else:
+                width = 2*self.minima[1] if np.isfinite(self.minima[1]) else 0.1
+                x = [self.minima[0] - width, self.minima[0], self.minima[0] + width]
+            tauMin, nllMin, x, y = minim.minimiseNll(x, self.tol)
+            parabError = minim.parabError(x, y)
+
+            #2D fit with background from the previous minimum, with errors from the inverse Hessian
+            tauStart, aStart = (0.4, 0.9) if self.minima is None else self.minima[2:]
+            bkgNllMin, bkgTauMin, bkgAMin, iterations = minim.bkgNewtonMinimiseNll(tauStart, aStart)[:4]
+            tauError, aError = minim.bkgContourError(bkgTauMin, bkgAMin, bkgNllMin, method='hessian')[::2]
+
+        self.minima = (tauMin, parabError, bkgTauMin, bkgAMin)
+
+        return {
+            'readings': self.columns.size, 'newReadings': newReadings,
+            'tau1D': tauMin, 'tauError1D': parabError, 'nll1D': nllMin,
+            'tau': bkgTauMin, 'a': bkgAMin, 'tauError': tauError, 'aError': aError, 'nll': bkgNllMin,
+            'iterations': iterations, 'seconds': time.time() - start,
+        }
+
+    def follow(self, interval=1., minReadings=1, maxUpdates=None, callback=None):
+        """Checks the file for new readings every interval seconds, passing each new set of results to callback, until maxUpdates fits have been made (or forever)."""
+
+        updates = 0
+        while True:
+            start = time.time()
+            results = self.update(minReadings)
+            if results is not None:
+                updates += 1
+                if callback is not None:
+                    callback(results)
+                if maxUpdates is not None and updates >= maxUpdates:
+                    break
+            time.sleep(max(0., interval - (time.time() - start))) #Keeping to the cadence however long the fit took
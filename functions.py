@@ -1,17 +1,119 @@
 import numpy as np
 import scipy.special as sp
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+
+ERFC_LIMIT = 25. #Above this argument erfc(z) underflows, so the scaled function erfcx(z) = exp(z**2)*erfc(z) is used instead
+ERFC_LIMIT_FLOAT32 = 9. #erfc(z) underflows much sooner in single precision
 
 class Functions(object):
     
     """A class where all the mathematical fits required for analysis have been created.
-    This includes Probability Density Functions (PDFs) and NLL fits."""
+    This includes Probability Density Functions (PDFs) and NLL fits.
+    All tau independent quantities for the measurements are calculated once on creation and reused by every NLL evaluation.
+    The times and errors may also hold several datasets as rows, in which case tau and a should be columns and nll, bkgNll and bkgNllDerivatives give one result per dataset.
+    If the times and errors are both float32 (eg. from Data with dtype=np.float32), the per-reading terms are kept in float32 and summed in float64, halving their memory (see benchmark.py --compact for the effect on the fits)."""
     
     
     def __init__(self, times, errors, sigma):
         self.times = times
         self.errors = errors
         self.sigma = sigma
+        self._cacheInvariants(times, errors)
+        
+    def _cacheInvariants(self, times, errors):
+        """Precomputes the per-measurement terms which do not depend on tau or a, along with scratch buffers reused by nll and bkgNll.
+        The buffers mean that a single object should not be evaluated from several threads at once."""
+        
+        self._dtype = termType(times, errors) #Precision of the per-reading terms
+        self._erfcLimit = ERFC_LIMIT_FLOAT32 if self._dtype == np.float32 else ERFC_LIMIT
+        self.precision = np.finfo(self._dtype).eps #Relative rounding error of each reading's terms, which limits how finely the minimisers can resolve the NLL
+        
+        times = np.asarray(times, dtype=self._dtype)
+        errors = np.asarray(errors, dtype=self._dtype)
+        
+        self._times = times
+        self._sigmaSq = errors**2
+        self._sigmaRoot2 = (errors/np.sqrt(2)).astype(self._dtype) #The erfc argument is sigma/(root(2)*tau) - times/(root(2)*sigma)
+        self._ratioRoot2 = (times/(errors*np.sqrt(2))).astype(self._dtype)
+        self._bkgTerm = (np.exp(-0.5*((times/errors)**2))/(errors*np.sqrt(2*np.pi))).astype(self._dtype) #Gaussian term for false readings
+        
+        self._exponentTotals = None #Used by nll for float32 readings
+        
+        self._buffer = np.empty_like(times) #Scratch arrays filled in place during each evaluation
+        self._scratch = np.empty_like(times)
+        
+    def _parameter(self, value):
+        """Converts tau or a (a scalar or a column) to the precision of the per-reading terms, so float32 terms are not promoted to float64 during evaluation."""
+        
+        return np.asarray(value, dtype=self._dtype)
+        
+    def _total(self, values):
+        """Adds up per-measurement values (along the last axis) into the NLL sums, accumulating in float64 whatever the precision of the values."""
+        
+        return np.sum(values, axis=-1, dtype=np.float64) #numpy sums pairwise, so the rounding error grows only as log(readings)
+        
+    def _erfcArgument(self, tau, out=None):
+        """Calculates the erfc argument z of the background-free pdf for every measurement from the cached terms."""
+        
+        z = np.multiply(self._sigmaRoot2, 1./tau, out=out)
+        np.subtract(z, self._ratioRoot2, out=z)
+        
+        return z
+        
+    def _exponent(self, tau, out=None, scratch=None):
+        """Calculates the exponent 0.5*(sigma/tau)**2 - times/tau of the background-free pdf for every measurement from the cached terms."""
+        
+        u = np.multiply(self._sigmaSq, 0.5/tau**2, out=out)
+        u -= np.multiply(self._times, 1./tau, out=scratch)
+        
+        return u
+        
+    def _logErfc(self, z, out=None):
+        """Calculates log(erfc(z)) for every measurement, using log(erfcx(z)) - z**2 where erfc(z) would underflow."""
         
+        with np.errstate(divide='ignore'): #Any log(0) values are replaced just below
+            logErfc = np.log(sp.erfc(z, out=out), out=out)
+        
+        if np.max(z) > self._erfcLimit: #Recalculating any measurements far in the tail with erfcx to avoid log(0)
+            far = z > self._erfcLimit
+            logErfc[far] = np.log(sp.erfcx(z[far])) - z[far]**2
+            
+        return logErfc
+        
+    def _logSignalPdf(self, tau, out=None, scratch=None):
+        """Calculates the log of the background-free pdf (equation (3) in submitted report) for every measurement.
+        Working with the log directly, exp(exponent)*erfc(z) only needs an erfc and a log call per measurement.
+        Where erfc(z) would underflow, log(erfc(z)) is found from log(erfcx(z)) - z**2 instead.
+        tau may be a scalar or a column of values, and the out and scratch arrays are filled in place if given."""
+        
+        logPdf = self._logErfc(self._erfcArgument(tau, out=scratch), out=out)
+        logPdf += self._exponent(tau, out=scratch)
+        logPdf -= np.log(2.*tau)
+        
+        return logPdf #Returning the log pdf values to be used in the nll function
+        
+    def _signalPdf(self, tau, out=None, scratch=None):
+        """Calculates the background-free pdf (equation (3) in submitted report) for every measurement from the cached terms.
+        Where erfc(z) would underflow, exp(exponent)*erfc(z) is found from exp(-0.5*(times/sigma)**2)*erfcx(z) instead.
+        tau may be a scalar or a column of values, and the out and scratch arrays are filled in place if given."""
+        
+        pdf = np.exp(self._exponent(tau, out=out, scratch=scratch), out=out)
+        z = self._erfcArgument(tau, out=scratch)
+        
+        far = None
+        if np.max(z) > self._erfcLimit: #Calculating any measurements far in the tail with erfcx to avoid underflow
+            far = z > self._erfcLimit
+            gaussExp = np.exp(-0.5*np.broadcast_to(self._times, z.shape)[far]**2/np.broadcast_to(self._sigmaSq, z.shape)[far]) #Equal to the exponential term multiplied by exp(-z**2), only needed for these few measurements
+            tail = gaussExp*sp.erfcx(z[far])*np.broadcast_to(0.5/tau, z.shape)[far]
+            
+        pdf *= sp.erfc(z, out=z)
+        pdf *= 0.5/tau
+        
+        if far is not None:
+            pdf[far] = tail
+            
+        return pdf #Returning the pdf values to be used in the NLL functions
         
     def fitFunction(self, tau, times, sigma):
         """Calculates the PDF in the absence of background effects (equation (3) in submitted report).
@@ -29,10 +131,31 @@ class Functions(object):
         The pdf (directly above) without background is used here.
         The value is dependent on the tau parameter used."""
             
-        likelihood = -np.sum(np.log(self.fitFunction(tau, self.times, self.errors))) #Taking the negative sum of pdf calculations from all measurements in raw data
+        if self._dtype != np.float64:
+            return self._compactNll(tau)
+        
+        likelihood = -self._total(self._logSignalPdf(self._parameter(tau), self._buffer, self._scratch)) #Taking the negative sum of the log pdf calculations from all measurements in raw data
         
         return likelihood #Returning the computed NLL value for plotting (later)
         
+    def _compactNll(self, tau):
+        """Calculates nll for float32 readings, where rounding 1/tau, 1/tau**2 and log(tau) separately would shift every reading's terms together by up to 1e-7 each.
+        Only the erfc terms are calculated per reading, from 1/tau rounded once to float32.
+        The exponent and normalisation are linear in sums of the readings, so they are added in float64 from that same rounded value."""
+        
+        if self._exponentTotals is None: #Sums of sigma**2/2, the times and the readings, found once
+            self._exponentTotals = (0.5*self._total(self._sigmaSq), self._total(self._times), self._total(np.ones_like(self._times)))
+        halfSigmaSqTotal, timesTotal, count = self._exponentTotals
+        
+        inverse = self._parameter(1./tau)
+        z = np.multiply(self._sigmaRoot2, inverse, out=self._scratch)
+        z -= self._ratioRoot2
+        
+        inverse = np.asarray(inverse, dtype=np.float64) #Exactly the values used in the erfc terms
+        if inverse.ndim: #One value per dataset for a column of tau values
+            inverse = inverse[..., 0]
+        return -(self._total(self._logErfc(z, out=self._buffer)) + halfSigmaSqTotal*inverse**2 - timesTotal*inverse + count*np.log(0.5*inverse))
+        
     def bkgFitFunction(self, tau, a, times, sigma):
         """Calculates the PDF with inclusion of background effects (equation (6) in submitted report).
         Parameters of tau, times and sigma need to be input. 
@@ -44,11 +167,303 @@ class Functions(object):
         
         return pdfWithBkg #Returning the computed pdf value to be used in the bkgNll function
         
+    def bkgFitDerivatives(self, tau, a, times, sigma):
+        """Calculates the PDF with background (equation (6) in submitted report) along with its closed-form derivatives with respect to tau and a.
+        Returns the pdf, the first derivatives (d/dtau, d/da) and the second derivatives (d2/dtau2, d2/dtau da).
+        The second derivative with respect to a alone is zero, as the pdf is linear in a."""
+        
+        signal = self.fitFunction(tau, times, sigma) #Pdf without background
+        bkgFunction = 1/(sigma*np.sqrt(2*np.pi)) * np.exp(-0.5 * ((times/sigma)**2)) #Gaussian term for false readings
+        
+        return self._derivatives(tau, a, times, sigma**2, signal, bkgFunction)
+        
+    def _derivatives(self, tau, a, times, sigmaSq, signal, bkgFunction):
+        """Combines the signal and background pdf values into the pdf with background and its derivatives, as returned by bkgFitDerivatives."""
+        
+        ratio = sigmaSq/tau**3 #The derivative of the erfc term reduces to this multiple of the Gaussian term
+        logSlope = -1./tau - ratio + times/tau**2 #Derivative of the log of the exponential term
+        
+        dSignal = signal*logSlope + ratio*bkgFunction #First derivative of the background-free pdf with respect to tau
+        d2Signal = dSignal*logSlope + signal*(1./tau**2 + 3*ratio/tau - 2*times/tau**3) - 3*ratio/tau*bkgFunction #Second derivative with respect to tau
+        
+        pdf = a*signal + (1 - a)*bkgFunction
+        
+        return pdf, (a*dSignal, signal - bkgFunction), (a*d2Signal, dSignal) #Returning the pdf and its derivatives to be used in the bkgNllDerivatives function
+        
     def bkgNll(self, tau, a):
         """Calculates the NLL (equation (5) in report) with background readings. 
         The pdf (directly above) with background is used here.
         The value is dependent on both the tau and a parameters used."""
             
-        likelihood = -np.sum(np.log(self.bkgFitFunction(tau, a, self.times, self.errors))) #Taking the negative sum of pdf calculations from all measurements in raw data
+        tau, a = self._parameter(tau), self._parameter(a)
+        pdf = self._signalPdf(tau, self._buffer, self._scratch) #Calculating the pdf for all measurements in raw data, using the cached background term
+        pdf *= a
+        pdf += np.multiply(self._bkgTerm, 1 - a, out=self._scratch)
+        likelihood = -self._total(np.log(pdf, out=pdf)) #Taking the negative sum of the log of the pdf calculations
+        
+        return likelihood #Returning the computed NLL value for plotting (later)
+        
+    def bkgNllDerivatives(self, tau, a):
+        """Calculates the NLL with background readings along with its analytic gradient and Hessian with respect to (tau, a).
+        Returns the NLL value, the gradient as a 2 element array and the Hessian as a 2x2 array."""
+        
+        tau, a = self._parameter(tau), self._parameter(a)
+        pdf, first, second = self._derivatives(tau, a, self._times, self._sigmaSq, self._signalPdf(tau), self._bkgTerm)
+        
+        dTau = first[0]/pdf #Derivatives of the log of the pdf for every measurement
+        dA = first[1]/pdf
+        
+        likelihood = -self._total(np.log(pdf))
+        gradient = -np.array([self._total(dTau), self._total(dA)])
+        
+        #Second derivatives of -log(pdf) summed over all measurements
+        tauTau = self._total(dTau**2 - second[0]/pdf)
+        tauA = self._total(dTau*dA - second[1]/pdf)
+        aA = self._total(dA**2)
+        hessian = np.array([[tauTau, tauA], [tauA, aA]])
+        
+        return likelihood, gradient, hessian #Returning the NLL value with its derivatives for the Newton minimiser
+        
+    def bkgNllGrid(self, taus, aValues):
+        """Calculates the 2D NLL (with background) for whole arrays of tau and a values.
+        The tau and a arrays (eg. from a meshgrid) are broadcast against each other and an array of NLL values of the same shape is returned.
+        The signal pdf, which needs the exp and erfc calls, is found once for each distinct tau value and shared by all of its a values, so each further grid point only costs a multiply, add and log per measurement.
+        Only three arrays the size of the measurements are used, however large the grid."""
+        
+        taus, aValues = np.broadcast_arrays(np.asarray(taus, dtype=float), np.asarray(aValues, dtype=float)) #Matching the shapes of the tau and a inputs
+        flatTaus = taus.ravel()
+        flatAs = aValues.ravel()
+        
+        likelihoods = np.empty(flatTaus.size)
+        mixture = np.empty_like(self._times)
+        
+        uniqueTaus, group = np.unique(flatTaus, return_inverse=True)
+        for index, tau in enumerate(uniqueTaus): #Evaluating every grid point sharing this tau value from one signal pdf
+            pdf = self._signalPdf(self._parameter(tau), self._buffer, self._scratch)
+            pdf -= self._bkgTerm #The pdf with background is then bkgTerm + a*(pdf - bkgTerm)
+            for point in np.flatnonzero(group == index):
+                np.multiply(pdf, self._parameter(flatAs[point]), out=mixture)
+                mixture += self._bkgTerm
+                likelihoods[point] = -self._total(np.log(mixture, out=mixture))
+            
+        return likelihoods.reshape(taus.shape) #Returning the NLL surface in the shape of the inputs
+
+
+def termType(times, errors):
+    """Returns the precision the per-reading terms are calculated in: float32 if the times and errors are both float32, otherwise float64."""
+    
+    compact = np.asarray(times).dtype == np.float32 and np.asarray(errors).dtype == np.float32
+    
+    return np.dtype(np.float32 if compact else float)
+
+
+class CompensatedSum(object):
+    
+    """Adds up partial results (scalars, arrays or tuples of these) using Neumaier's compensated summation.
+    This keeps the rounding error of a total over many chunks independent of the number of chunks."""
+    
+    def __init__(self):
+        self.total = None
+        self.compensation = None
+        
+    def add(self, part):
+        """Adds one partial result to the running total."""
+        
+        if isinstance(part, tuple):
+            if self.total is None:
+                self.total = [CompensatedSum() for value in part]
+            for accumulator, value in zip(self.total, part):
+                accumulator.add(value)
+            return
+        
+        part = np.asarray(part, dtype=float)
+        if self.total is None:
+            self.total = part.copy()
+            self.compensation = np.zeros_like(self.total)
+            return
+        
+        newTotal = self.total + part
+        self.compensation += np.where(np.abs(self.total) >= np.abs(part), (self.total - newTotal) + part, (part - newTotal) + self.total) #Recovering the low order bits lost in the addition
+        self.total = newTotal
+        
+    def value(self):
+        """Returns the compensated total, in the same form as the partial results."""
+        
+        if isinstance(self.total, list):
+            return tuple(accumulator.value() for accumulator in self.total)
+        
+        value = self.total + self.compensation
+        
+        return value[()] if value.ndim == 0 else value #Scalars are returned as numpy floats, like a plain np.sum
+        
+        
+class PartitionedFunctions(Functions):
+    
+    """A base class for versions of Functions which split the readings into parts and add up the NLL functions of each part.
+    Subclasses provide _reduce, which evaluates a named Functions method on every part and returns the combined total."""
+    
+    def nll(self, tau):
+        """Calculates the NLL in the absence of background effects, adding up the totals of each part."""
+        
+        return self._reduce('nll', tau)
+        
+    def bkgNll(self, tau, a):
+        """Calculates the NLL with background readings, adding up the totals of each part."""
+        
+        return self._reduce('bkgNll', tau, a)
+        
+    def bkgNllDerivatives(self, tau, a):
+        """Calculates the NLL with background readings along with its gradient and Hessian, adding up the totals of each part."""
+        
+        return self._reduce('bkgNllDerivatives', tau, a)
+        
+    def bkgNllGrid(self, taus, aValues):
+        """Calculates the 2D NLL for whole arrays of tau and a values, adding up the totals of each part."""
+        
+        return self._reduce('bkgNllGrid', taus, aValues)
+        
+        
+class StreamingFunctions(PartitionedFunctions):
+    
+    """A version of Functions for datasets too large to hold in memory.
+    The times and errors should be memory-mapped arrays (eg. from Data.readData with the cache), which are worked through in chunks of chunkSize readings.
+    Only one chunk's cached terms and buffers exist at a time, so memory use is bounded whatever the number of readings.
+    The chunk totals are combined with compensated summation, and the NLL functions can be used by Minimiser in place of those of Functions."""
+    
+    def __init__(self, times, errors, sigma, chunkSize=1000000):
+        self.times = times
+        self.errors = errors
+        self.sigma = sigma
+        self.chunkSize = int(chunkSize)
+        self.precision = np.finfo(termType(times, errors)).eps
+        
+    def _reduce(self, name, *args):
+        """Evaluates the named Functions method on each chunk of the data in turn and returns the compensated total."""
+        
+        total = CompensatedSum()
+        
+        for start in range(0, len(self.times), self.chunkSize):
+            stop = start + self.chunkSize
+            chunk = Functions(self.times[start:stop], self.errors[start:stop], self.sigma) #Caching the per-reading terms of this chunk only
+            total.add(getattr(chunk, name)(*args))
+            
+        return total.value()
+        
+        
+class ShardedFunctions(PartitionedFunctions):
+    
+    """A version of Functions which evaluates the NLL functions over several shards of the readings at once on a thread pool.
+    The numpy and scipy functions used release the GIL, so the shards are evaluated in parallel on separate cores.
+    Shard totals are always combined in shard order with compensated summation, so results are repeatable and agree with Functions to a relative tolerance of 1e-12.
+    As with Functions, a single object should not be evaluated from several threads at once."""
+    
+    def __init__(self, times, errors, sigma, workers=None, shards=None):
+        self.times = times
+        self.errors = errors
+        self.sigma = sigma
+        self.workers = workers if workers else multiprocessing.cpu_count()
+        self.precision = np.finfo(termType(times, errors)).eps
+        
+        bounds = np.linspace(0, len(times), (shards if shards else self.workers) + 1).astype(int) #Splitting the readings into near equal shards
+        self.shards = [Functions(times[start:stop], errors[start:stop], sigma) for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start]
+        
+        self._pool = ThreadPool(self.workers)
+        
+    def _reduce(self, name, *args):
+        """Evaluates the named Functions method on every shard in parallel and returns the compensated total, added up in shard order."""
+        
+        results = self._pool.map(lambda shard: getattr(shard, name)(*args), self.shards)
+        
+        total = CompensatedSum()
+        for result in results:
+            total.add(result)
+            
+        return total.value()
+        
+    def close(self):
+        """Shuts down the thread pool once the object is no longer needed."""
+        
+        self._pool.close()
+        self._pool.join()
+        
+        
+class BinnedFunctions(Functions):
+    
+    """A version of Functions for very large datasets, where the readings are histogrammed once in (time, error) bins.
+    Each filled bin is treated as one reading at the mean time and error of its contents, and the NLL functions add up the pdf terms of the bins weighted by their counts.
+    Every evaluation then costs O(bins) rather than O(readings), and the NLL functions can be used by Minimiser in place of those of Functions.
+    Binning shifts the minimum slightly, which should be checked with accuracy against the statistical errors."""
+    
+    def __init__(self, times, errors, sigma, timeBins=2000, errorBins=200, chunkSize=1000000, histogram=None):
+        """If a ReadingHistogram is given, the times and errors are taken to have been added to it already and the bins are used as they are."""
+        
+        self.times = times
+        self.errors = errors
+        self.sigma = sigma
+        
+        if histogram is None:
+            histogram = ReadingHistogram(np.linspace(np.min(times), np.max(times), timeBins + 1), np.linspace(np.min(errors), np.max(errors), errorBins + 1))
+            histogram.add(times, errors, chunkSize)
+            
+        self.binTimes, self.binErrors, self.counts = histogram.bins()
+        self._cacheInvariants(self.binTimes, self.binErrors)
+        
+    def _total(self, values):
+        """Adds up per-bin values (along the last axis) weighted by the number of readings in each bin."""
+        
+        return np.dot(values, self.counts)
+        
+    def accuracy(self, tau, a, chunkSize=1000000):
+        """Compares the binned 2D NLL with the unbinned NLL of the original readings at (tau, a), which should be the binned minimum.
+        Returns a dictionary of the difference in NLL, the shifts in the minimum's tau and a caused by binning (from one Newton step of the unbinned NLL), and the statistical errors of tau and a for comparison."""
+        
+        unbinnedNll, unbinnedGradient, hessian = StreamingFunctions(self.times, self.errors, self.sigma, chunkSize).bkgNllDerivatives(tau, a)
+        binnedNll, binnedGradient = self.bkgNllDerivatives(tau, a)[:2]
+        
+        covariance = np.linalg.inv(hessian)
+        shift = covariance.dot(unbinnedGradient - binnedGradient) #Binned minus unbinned minimum, to first order
+        
+        return {
+            'nllDifference': binnedNll - unbinnedNll,
+            'tauShift': shift[0], 'aShift': shift[1],
+            'tauError': np.sqrt(covariance[0, 0]), 'aError': np.sqrt(covariance[1, 1]),
+        }
+        
+        
+class ReadingHistogram(object):
+    
+    """The number of readings, and the sums of their times and errors, in a fixed grid of (time, error) bins.
+    Readings can be added at any time, eg. as they are appended to a file, and readings outside the grid are counted in its edge bins."""
+    
+    def __init__(self, timeEdges, errorEdges):
+        self.timeEdges = np.asarray(timeEdges, dtype=float)
+        self.errorEdges = np.asarray(errorEdges, dtype=float)
+        
+        size = (len(self.timeEdges) - 1)*(len(self.errorEdges) - 1)
+        self.counts = np.zeros(size) #Flattened grids, indexed by time bin then error bin
+        self.timeSums = np.zeros(size)
+        self.errorSums = np.zeros(size)
+        
+    def _index(self, values, edges):
+        """Returns the bin of each value, with values outside the edges placed in the first or last bin."""
+        
+        return np.clip(np.searchsorted(edges, values, side='right') - 1, 0, len(edges) - 2)
+        
+    def add(self, times, errors, chunkSize=1000000):
+        """Adds readings to the histogram, working through them in chunks so memory-mapped data is never loaded at once."""
+        
+        for start in range(0, len(times), chunkSize):
+            chunkTimes = np.asarray(times[start:start + chunkSize], dtype=float)
+            chunkErrors = np.asarray(errors[start:start + chunkSize], dtype=float)
+            
+            index = self._index(chunkTimes, self.timeEdges)*(len(self.errorEdges) - 1) + self._index(chunkErrors, self.errorEdges)
+            self.counts += np.bincount(index, minlength=self.counts.size)
+            self.timeSums += np.bincount(index, chunkTimes, minlength=self.counts.size)
+            self.errorSums += np.bincount(index, chunkErrors, minlength=self.counts.size)
+            
+    def bins(self):
+        """Returns the mean time, mean error and number of readings of every filled bin."""
+        
+        filled = self.counts > 0
         
-        return likelihood #Returning the computed NLL value for plotting (later)
\ No newline at end of file
+        return self.timeSums[filled]/self.counts[filled], self.errorSums[filled]/self.counts[filled], self.counts[filled] #Using the mean of each bin's contents removes the first order binning error
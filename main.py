@@ -1,9 +1,15 @@
+from __future__ import print_function
 import numpy as np
-from scipy.integrate import trapz
+try:
+    from scipy.integrate import trapezoid as trapz
+except ImportError: #Older versions of scipy only have trapz
+    from scipy.integrate import trapz
 
 from data import Data
 from minimiser import Minimiser
-from functions import Functions
+from cache import ResultCache
+from surface import NllSurface
+from scheduler import Scheduler
 import plotting as pt
 
 """This is the main module, where everything is run. It imports all of the other 4 modules:
@@ -13,67 +19,125 @@ import plotting as pt
 4) plotting.py
 
 All plots and calculated values as featured in the report are outputted here.
-Simply clicking run will present the results.
-NOTE: AFTER RUNNING, IT CAN TAKE UP TO 35 SECONDS FOR RESULTS TO APPEAR."""
+Simply clicking run will present the results, followed by the time taken by each stage.
+The stages run in parallel and their results are cached in .nllcache, so the results take around a second to appear (and are near-instant on reruns)."""
         
 
-### RETRIEVING DATA FROM FILE ###
-times, errors = Data('lifetime.txt', 'r').readData() #Decay times and errors in picoseconds
-meanSigma = np.mean(errors) #Calculating mean of errors from data
-sortedTimes = np.sort(times) #Sorting times in ascending order
-
-### CREATING FUNCTION AND MINIMISER OBJECTS ###
-funcs = Functions(times, errors, meanSigma)
-minim = Minimiser(times, errors, meanSigma) 
-
-### CALCULATING VALUES AND PLOTTING LOCATIONS FOR 1D FIT (WITHOUT BACKGROUND) ###
-tauMin, nllMin, x, y = minim.minimiseNll([0.3, 0.4, 0.5], 1e-5) #Minimising NLL
-taus = np.linspace(tauMin-0.1, tauMin+0.1, 100) #Tau values in region of minimum
-likelihoods = np.array([funcs.nll(tau) for tau in taus]) #Calculating NLL over these tau values
-pdf = funcs.fitFunction(tauMin, sortedTimes, meanSigma) #Calculating pdf function without background
-area = trapz(pdf, sortedTimes) #Calculating area of pdf using trapezium rule
-#Calculating errors
-posError = minim.posError(tauMin, 1e-5)
-negError = minim.negError(tauMin, 1e-5)
+### STAGES OF THE ANALYSIS ###
+#Each stage is a task taking the results of the stages it depends on, so independent stages can run at the same time (see scheduler.py)
+dataFile = 'lifetime.txt'
+cache = ResultCache() #Results are stored in .nllcache and reused while lifetime.txt and the analysis modules are unchanged, so reruns are near-instant (delete .nllcache to clear it)
+
+def loadData():
+    times, errors = Data(dataFile, 'r').readData() #Decay times and errors in picoseconds
+    return times, errors, np.mean(errors), np.sort(times) #Also calculating mean of errors and sorting times in ascending order
+
+def newMinimiser(data):
+    """Creates the Minimiser for one stage. Every stage has its own, as the scratch buffers of the NLL functions cannot be shared between threads."""
+    times, errors, meanSigma = data[:3]
+    return Minimiser(times, errors, meanSigma)
+
+#1D fit (without background)
+def fitNll(data):
+    return cache.wrap(dataFile, 'minimiseNll', newMinimiser(data).minimiseNll)([0.3, 0.4, 0.5], 1e-5) #Minimising NLL
+
+def scanNll(data, fit):
+    funcs = newMinimiser(data).funcs
+    taus = np.linspace(fit[0]-0.1, fit[0]+0.1, 100) #Tau values in region of minimum
+    return taus, cache.wrap(dataFile, 'nllScan', lambda taus: np.array([funcs.nll(tau) for tau in taus]))(taus) #Calculating NLL over these tau values
+
+def makePdf(data, fit):
+    pdf = newMinimiser(data).funcs.fitFunction(fit[0], data[3], data[2]) #Calculating pdf function without background
+    return pdf, trapz(pdf, data[3]) #Calculating area of pdf using trapezium rule
+
+def findParabError(data, fit):
+    return newMinimiser(data).parabError(fit[2], fit[3])
+
+def findPosError(data, fit, parabError):
+    return cache.wrap(dataFile, 'posError', newMinimiser(data).posError)(fit[0], 1e-5, method='root', errorGuess=parabError) #Root-finding seeded by the parabolic estimate
+
+def findNegError(data, fit, parabError):
+    return cache.wrap(dataFile, 'negError', newMinimiser(data).negError)(fit[0], 1e-5, method='root', errorGuess=parabError)
+
+#Log of error in average lifetime with log of data subset size
+def findErrorVSReadings(data):
+    return cache.wrap(dataFile, 'errorVSReadings', newMinimiser(data).errorVSReadings)()
+
+#2D fit (with background)
+def fitBkgNll(data):
+    return cache.wrap(dataFile, 'bkgNewtonMinimiseNll', newMinimiser(data).bkgNewtonMinimiseNll)(0.4, 0.9) #Minimising 2D NLL with the analytic Newton method
+
+def makeBkgPdf(data, fit):
+    pdf = newMinimiser(data).funcs.bkgFitFunction(fit[1], fit[2], data[3], data[2]) #Calculating pdf function with background
+    return pdf, trapz(pdf, data[3]) #Calculating area of new pdf using trapezium rule
+
+def makeBkgSurface(data, fit):
+    bkgTaus = np.linspace(fit[1] - 0.05, fit[1] + 0.05, 100)  #Tau values in region of minimum
+    bkgAs = np.linspace(fit[2] - 0.05, 0.999, 100)  #a values in region of minimum
+    return NllSurface(bkgTaus, bkgAs, cache.wrap(dataFile, 'bkgNllGrid', newMinimiser(data).funcs.bkgNllGrid)) #2D NLL evaluated once over the grid (and cached on disk), then shared by the errors and plots
+
+def findBkgError(data, fit, surface):
+    return newMinimiser(data).bkgError(surface, tauMin=fit[1], aMin=fit[2], funcMin=fit[0])
+
+scheduler = Scheduler()
+scheduler.add('readData', loadData)
+scheduler.add('fit1D', fitNll, ['readData'])
+scheduler.add('nllScan', scanNll, ['readData', 'fit1D'])
+scheduler.add('pdf1D', makePdf, ['readData', 'fit1D'])
+scheduler.add('parabError', findParabError, ['readData', 'fit1D'])
+scheduler.add('posError', findPosError, ['readData', 'fit1D', 'parabError'])
+scheduler.add('negError', findNegError, ['readData', 'fit1D', 'parabError'])
+scheduler.add('errorVSReadings', findErrorVSReadings, ['readData'])
+scheduler.add('fit2D', fitBkgNll, ['readData'])
+scheduler.add('pdf2D', makeBkgPdf, ['readData', 'fit2D'])
+scheduler.add('bkgSurface', makeBkgSurface, ['readData', 'fit2D'])
+scheduler.add('bkgError', findBkgError, ['readData', 'fit2D', 'bkgSurface'], mainThread=True) #Finding the contour uses matplotlib, which must stay on the main thread
+results = scheduler.run()
+
+### COLLECTING THE RESULTS OF EACH STAGE ###
+times, errors, meanSigma, sortedTimes = results['readData']
+tauMin, nllMin, x, y = results['fit1D']
+taus, likelihoods = results['nllScan']
+pdf, area = results['pdf1D']
+parabError = results['parabError']
+posError = results['posError']
+negError = results['negError']
 meanError = np.mean([posError, negError])
-parabError = minim.parabError(x, y)
-    
-### CALCULATING LOG OF ERROR IN AVERAGE LIFETIME WITH LOG OF DATA SUBSET SIZE ###
-sizes, sizeErrors = minim.errorVSReadings()
-
-### CALCULATING VALUES AND PLOTTING LOCATIONS FOR 2D FIT (WITH BACKGROUND) ###
-bkgNllMin, bkgTauMin, bkgAMin = minim.bkgMinimiseNll(0.4, 0.9)#Minimising 2D NLL
-bkgTaus = np.linspace(bkgTauMin - 0.05, bkgTauMin + 0.05, 100)  #Tau values in region of minimum
-bkgAs = np.linspace(bkgAMin - 0.05, 0.999, 100)  #a values in region of minimum
+sizes, sizeErrors = results['errorVSReadings']
+bkgNllMin, bkgTauMin, bkgAMin, iterations, evaluations = results['fit2D']
 fractionBkg = 1 - bkgAMin #Calculating fraction of false readings in sample
-pdf2 = funcs.bkgFitFunction(bkgTauMin, bkgAMin, sortedTimes, meanSigma) #Calculating pdf function with background
-area2 = trapz(pdf2, sortedTimes) #Calculating area of new pdf using trapezium rule
-#Calculating errors
-TauAErrors = minim.bkgError(bkgTaus, bkgAs, bkgTauMin, bkgAMin, bkgNllMin, funcs.bkgNll)
+pdf2, area2 = results['pdf2D']
+bkgSurface = results['bkgSurface']
+TauAErrors = results['bkgError']
 meanTauError = np.mean([TauAErrors[0], TauAErrors[1]])
 meanAError = np.mean([TauAErrors[2], TauAErrors[3]])
  
 
 ### CREATING AND DISPLAYING PLOTS ###
-pt.plotContour(bkgTaus, bkgAs, funcs.bkgNll, levels = np.arange(bkgNllMin+0.5, bkgNllMin+0.5+100, 10))
-pt.plot3D(bkgTaus, bkgAs, funcs.bkgNll)
+pt.plotContour(bkgSurface, levels = np.arange(bkgNllMin+0.5, bkgNllMin+0.5+100, 10))
+pt.plot3D(bkgSurface)
 intersect, m, c = pt.plotErrorsVSReadings(sizes, sizeErrors)
 pt.plotNLL(taus, likelihoods, tauMin, nllMin)
 pt.plotHist(times, bins=100, sortedTimes=sortedTimes, pdfs=[pdf, pdf2])
 
 ### PRINTING RESULTS ###
-print "Area under initial PDF (without background):", area
-print "Area under refined PDF (with background):", area2
-print "NLL at Minimum 1D:", nllMin
-print "Tau at Minimum 1D:", tauMin, "picoseconds"
-print "Positive Tau Error 1D:", posError, "picoseconds"
-print "Negative Tau Error 1D:", negError, "picoseconds"
-print "Mean Tau Error 1D:", meanError, "picoseconds"
-print "Last Parabolic Estimate Error of Tau:", parabError, "picoseconds"
-print "Intersect of extrapolation of gradient", m, "and intercept", c,  "gives approximately", int(10**intersect[0]), "readings required for accuracy of 0.001ps"  
-print "NLL at Minimum 2D:", bkgNllMin
-print "Tau at Minimum 2D:", bkgTauMin, "picoseconds"
-print "Mean Tau Error from contour at NLLMin + 0.5:", meanTauError, "picoseconds"
-print "a at Minimum 2D:", bkgAMin
-print "Mean a Error from contour at NLLMin + 0.5:", meanAError
-print "Number of Background Readings out of 10,000:", int(np.round(fractionBkg*10000))
\ No newline at end of file
+print("Area under initial PDF (without background):", area)
+print("Area under refined PDF (with background):", area2)
+print("NLL at Minimum 1D:", nllMin)
+print("Tau at Minimum 1D:", tauMin, "picoseconds")
+print("Positive Tau Error 1D:", posError, "picoseconds")
+print("Negative Tau Error 1D:", negError, "picoseconds")
+print("Mean Tau Error 1D:", meanError, "picoseconds")
+print("Last Parabolic Estimate Error of Tau:", parabError, "picoseconds")
+print("Intersect of extrapolation of gradient", m, "and intercept", c,  "gives approximately", int(10**intersect[0]), "readings required for accuracy of 0.001ps")
+print("NLL at Minimum 2D:", bkgNllMin)
+print("Tau at Minimum 2D:", bkgTauMin, "picoseconds")
+print("Mean Tau Error from contour at NLLMin + 0.5:", meanTauError, "picoseconds")
+print("a at Minimum 2D:", bkgAMin)
+print("Newton iterations and NLL evaluations for 2D minimum:", iterations, evaluations)
+print("Mean a Error from contour at NLLMin + 0.5:", meanAError)
+print("Number of Background Readings out of 10,000:", int(np.round(fractionBkg*10000)))
+
+### TIME TAKEN BY EACH STAGE ###
+print("")
+print(scheduler.summary())
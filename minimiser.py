@@ -1,7 +1,9 @@
 import numpy as np
-from functions import Functions 
-from data import Data
-from matplotlib import pyplot as plt
+import multiprocessing
+from functions import Functions, ShardedFunctions
+from profiler import Profiler
+from surface import gridSurface
+from scipy.optimize import brentq, minimize_scalar
 
 class Minimiser(object):
     
@@ -9,16 +11,56 @@ class Minimiser(object):
     This is for both with and without background adjustments made."""
     
     
-    def __init__(self, times, errors, sigma):
+    def __init__(self, times, errors, sigma, funcs=None, workers=1):
         self.times = times
         self.errors = errors
         self.sigma = sigma
-        self.funcs = Functions(times, errors, sigma)
+        
+        if funcs is not None: #Any object with the NLL functions of Functions can be used, eg. StreamingFunctions
+            self.funcs = funcs
+        elif workers > 1: #Evaluating the NLL functions over shards of the data on several cores
+            self.funcs = ShardedFunctions(times, errors, sigma, workers)
+        else:
+            self.funcs = Functions(times, errors, sigma)
+            
+        self.profiler = None #Iterations are only traced once profiling has been enabled
+        self._owned = self.funcs if funcs is None else None #NLL functions created here, which close shuts down
+        
+    def close(self):
+        """Shuts down the thread pool of the NLL functions if they were created with workers > 1. Functions passed in are left for their owner to close."""
+        
+        if self._owned is not None and hasattr(self._owned, 'close'):
+            self._owned.close()
+        self._owned = None
+        
+    def __enter__(self):
+        return self
+        
+    def __exit__(self, *exc):
+        self.close()
+        
+    def enableProfiling(self, profiler=None):
+        """Starts counting and timing the NLL function calls and tracing the iterations of every routine.
+        A new Profiler is created unless one is given, and it is returned so the results can be inspected or exported."""
+        
+        if self.profiler is None:
+            self.profiler = profiler if profiler is not None else Profiler()
+            self.funcs = self.profiler.wrap(self.funcs)
+            
+        return self.profiler
+        
+    def disableProfiling(self):
+        """Stops profiling, returning the NLL functions to their unwrapped form."""
+        
+        if self.profiler is not None:
+            self.funcs = self.funcs.funcs
+            self.profiler = None
 
 
     def minimiseNll(self, x=[0.3, 0.4, 0.5], tol = 1e-5):
         """Calculates the 1D NLL minimum in the absence of background effects using the parabolic method.
-        3 initial points and a tolerance level need to be specificed."""
+        3 initial points and a tolerance level need to be specificed.
+        For float32 readings the returned points are spaced about one error apart around the minimum, so that parabError measures the curvature rather than rounding."""
         
         x = np.asarray(x) # Converting the 3 input x points on the parabola into an array
         y = []
@@ -29,6 +71,7 @@ class Minimiser(object):
         np.asarray(y)
         
         difference = 2 * tol 
+        iteration = 0
         
         while difference > tol: # The process is stopped once the difference between consecutive x points is below a specified tolerance
             
@@ -41,17 +84,44 @@ class Minimiser(object):
             
             difference = abs(newX - x[np.argmin(y)]) #If the difference is below the tolerance, the process is stopped
             
+            iteration += 1
+            if self.profiler is not None:
+                self.profiler.trace('minimiseNll', iteration, newX, None, newY, difference)
+            
             if newY < y[np.argmax(y)]: #Replacing highest y (and corresponding x) value with new one
                 x[np.argmax(y)] = newX
                 y[np.argmax(y)] = newY
-            
-                
+            else: #The parabola is unchanged, so the same point would be found again forever (only happens when NLL rounding, eg. of float32 readings, is larger than its change over the tolerance)
+                break
+
         xMin = x[np.argmin(y)] #Minimisation of NLL has been achieved 
         yMin = y[np.argmin(y)]
         
+        if getattr(self.funcs, 'precision', np.finfo(float).eps) > np.finfo(float).eps: #The last points are too close together for their curvature to rise above the rounding of float32 readings
+            x, y = self._errorParabola(xMin, yMin, x, y)
+        
         return xMin, yMin, x, y #Returning x,y values are the minimum, as well as the list of the last parabolic estimate to be used for error calculations
         
         
+    def _errorParabola(self, xMin, yMin, x, y):
+        """Returns 3 points at tauMin and about one error either side of it, for parabError when the NLL carries float32 rounding.
+        The spacing starts from the error of the last parabola and is corrected until it agrees with the error it gives to 10%."""
+        
+        with np.errstate(invalid='ignore'): #The rounding can make the last parabola curve the wrong way, giving NaN
+            width = self.parabError(x, y)
+        if not (np.isfinite(width) and width > 0):
+            width = 0.01*xMin
+        
+        for attempt in range(5):
+            x = np.array([xMin - width, xMin, xMin + width])
+            y = [self.funcs.nll(x[0]), yMin, self.funcs.nll(x[2])]
+            error = self.parabError(x, y)
+            if not (np.isfinite(error) and error > 0) or abs(error - width) < 0.1*width:
+                break
+            width = error
+            
+        return x, y
+        
     def parabError(self, x, y):
         """Calculates the error in the optimum value from the minimised NLL using the curvature of the last parabolic estimate from the parabolic algorithm (above).
         The last parabolic estimate x,y values need to be input."""
@@ -64,9 +134,15 @@ class Minimiser(object):
         
         return error #Returning the error calculated
         
-    def posError(self, tauMin, tol=1e-5):
+    def posError(self, tauMin, tol=1e-5, method='scan', errorGuess=None):
         """Calculates the positive error in the optimum tau value from the minimised NLL by moving at small increments until surpassing NLLMin + 0.5
-        The increments are specified by the tolerance."""
+        The increments are specified by the tolerance.
+        With method='root', the crossing of NLLMin + 0.5 is instead found to within the tolerance by Brent's method, seeded by errorGuess (eg. from parabError)."""
+        
+        if method == 'root':
+            return self._rootError(tauMin, 1, tol, errorGuess)
+        elif method != 'scan':
+            raise ValueError("method must be 'scan' or 'root'")
         
         nllMin = self.funcs.nll(tauMin) #Calculating NLL from the optimum tau value
         
@@ -77,6 +153,9 @@ class Minimiser(object):
             
             nllValue = self.funcs.nll(i) #Calculating nll at each tau value, one at a time
             
+            if self.profiler is not None:
+                self.profiler.trace('posError', len(taus) + 1, i, None, nllValue, tol)
+            
             if nllValue > shiftNll: #If the nll calculation surpasses the 0.5 shift, stop iterating
                 break
             else:
@@ -87,9 +166,15 @@ class Minimiser(object):
         return positiveError #Returning the positive tau error calculated
         
         
-    def negError(self, tauMin, tol=1e-5):
+    def negError(self, tauMin, tol=1e-5, method='scan', errorGuess=None):
         """Calculates the negative error in the optimum tau value from the minimised NLL by moving at small increments until surpassing NLLMin + 0.5
-        The increments are specified by the tolerance."""
+        The increments are specified by the tolerance.
+        With method='root', the crossing of NLLMin + 0.5 is instead found to within the tolerance by Brent's method, seeded by errorGuess (eg. from parabError)."""
+        
+        if method == 'root':
+            return self._rootError(tauMin, -1, tol, errorGuess)
+        elif method != 'scan':
+            raise ValueError("method must be 'scan' or 'root'")
         
         nllMin = self.funcs.nll(tauMin) #Calculating NLL from the optimum tau value
         
@@ -100,6 +185,9 @@ class Minimiser(object):
             
             nllValue = self.funcs.nll(i)
             
+            if self.profiler is not None:
+                self.profiler.trace('negError', len(taus) + 1, i, None, nllValue, tol)
+            
             if nllValue > shiftNll: #If the nll calculation surpasses the 0.5 shift, stop iterating
                 break
             else:
@@ -109,28 +197,64 @@ class Minimiser(object):
         
         return negativeError #Returning the negative tau error calculated
         
-    def errorVSReadings(self, lowerRange=1000, upperRange=10000):
+    def _rootError(self, tauMin, direction, tol, errorGuess=None):
+        """Finds the distance from tauMin to where the 1D NLL reaches NLLMin + 0.5, on the side given by direction (+1 or -1).
+        The root is bracketed starting from errorGuess (or 1% of tauMin if it is missing, not finite or not positive) and then located with Brent's method to within the tolerance."""
+        
+        nllMin = self.funcs.nll(tauMin)
+        routine = 'posError' if direction > 0 else 'negError'
+        evaluations = [0]
+        
+        def shiftNll(tau):
+            nllValue = self.funcs.nll(tau)
+            if self.profiler is not None:
+                evaluations[0] += 1
+                self.profiler.trace(routine, evaluations[0], tau, None, nllValue, abs(tau - tauMin))
+            return nllValue - nllMin - 0.5 #Zero at the required crossing point
+        
+        limit = tauMin if direction > 0 else 0.5*tauMin #Searching no further than the 'scan' method does, ie. up to 2*tauMin or down to 0.5*tauMin
+        usable = errorGuess is not None and np.isfinite(errorGuess) and errorGuess > 0 #parabError is NaN when the last parabola curves the wrong way
+        step = 1.5*errorGuess if usable else 0.01*tauMin #Initial bracket just beyond the expected error
+        step = min(step, limit)
+        
+        while shiftNll(tauMin + direction*step) < 0: #Widening the bracket until NLLMin + 0.5 is surpassed
+            if step >= limit:
+                raise ValueError("NLL does not reach NLLMin + 0.5 within the search range")
+            step = min(2*step, limit)
+            
+        root = brentq(shiftNll, tauMin, tauMin + direction*step, xtol=tol) #Locating the crossing point within the bracket
+        
+        return abs(root - tauMin) #Returning the error calculated
+        
+    def errorVSReadings(self, lowerRange=1000, upperRange=10000, step=100, processes=1, warmStart=False):
         """Calculates the error in the optimum tau value for varying subsets of the data provided.
-        The range of data sizes required is specified."""
+        The range of data sizes required and the step between them is specified. Each subset is the first readings of the data held by this object.
+        With processes > 1 the subset fits are shared out over a process pool, and with warmStart each fit starts from the previous subset's minimum."""
         
-        sizes = []
-        sizeErrors = []
+        sizes = list(range(lowerRange, upperRange+1, step)) #Varying number of readings from the data
         
-        for i in range(lowerRange, upperRange+100, 100): #Iterating of varying number of readings from the data
-            
-            times, errors = Data('lifetime.txt', 'r').readData(size=i) #Reading text file up to specified size limit
+        if sizes and sizes[-1] > len(self.times):
+            raise ValueError("upperRange is larger than the number of readings available")
         
-            meanSigma = np.mean(errors) #Calculating the mean sigma from all the errors of the data subset
-            minim = Minimiser(times, errors, meanSigma) #Instantiating Minimiser object for the required data subset
-            
-            tauMin, nllMin, x, y = minim.minimiseNll([0.3, 0.4, 0.5], 1e-5) #Calculating the NLL minimum, along with the last parabolic estimate
-            parabError = minim.parabError(x, y) #Calculating error in best estimate of tau using parabolic approach
+        if processes <= 1:
+            sizeErrors = _fitSubsets(self.times, self.errors, sizes, warmStart)
+        else:
+            if warmStart: #Contiguous blocks of sizes, so that each worker can warm start along its own block
+                blocks = [list(block) for block in np.array_split(sizes, processes)]
+            else: #Interleaved blocks of sizes, so that the larger subsets are spread evenly over the workers
+                blocks = [sizes[i::processes] for i in range(processes)]
             
-            sizes.append(i)
-            sizeErrors.append(parabError)
+            pool = multiprocessing.Pool(processes, _initSubsetWorker, (self.times, self.errors)) #The full data is sent once to each worker, rather than with every subset
+            try:
+                results = pool.map(_fitSubsetsInWorker, [(block, warmStart) for block in blocks if block])
+            finally:
+                pool.close()
+                pool.join()
             
-        np.asarray(sizes) 
-        np.asarray(sizeErrors)
+            errorsBySize = {}
+            for block, blockErrors in zip([block for block in blocks if block], results):
+                errorsBySize.update(zip(block, blockErrors))
+            sizeErrors = [errorsBySize[i] for i in sizes]
         
         return sizes, sizeErrors #Returning an array of the varying data sizes, along with an array of associated errors
         
@@ -151,6 +275,10 @@ class Minimiser(object):
         
         difference = abs(y1 - y0) #Difference between new and previous NLL value calculated
         
+        iteration = 1
+        if self.profiler is not None:
+            self.profiler.trace('bkgMinimiseNll', iteration, x1[0], x1[1], y1, alpha*np.linalg.norm(grads))
+        
         while difference > tol: #Entire process continuously repeated until difference in NLL is below tolerance
             
             x0 = x1
@@ -166,24 +294,90 @@ class Minimiser(object):
             
             difference = abs(y1 - y0)
             
+            iteration += 1
+            if self.profiler is not None:
+                self.profiler.trace('bkgMinimiseNll', iteration, x1[0], x1[1], y1, alpha*np.linalg.norm(grads))
+            
         return y1, x1[0], x1[1] #NLL at minimum and (tau, a) coordinates at minimum returned
         
-    def bkgError(self, tau, a, tauMin, aMin, funcMin, function):
-        """Calculates the errors in the optimum tau and a values from the minimised 2D NLL by analysing contour at NLLMin + 0.5."""
+    def bkgNewtonMinimiseNll(self, tauStart, aStart, tol=1e-6, maxIter=100):
+        """Calculates the 2D NLL minimum including background effects using a damped Newton method with the analytic gradient and Hessian.
+        Each Newton step is shortened by a backtracking line search until the NLL decreases sufficiently, whilst staying within tau > 0 and 0 < a <= 1.
+        The process is stopped once the gradient (ignoring a when it is held at a = 1) is below the tolerance, or the Newton step can no longer lower the NLL by more than its rounding error, when that last step is taken without the line search.
+        The NLL at the minimum, the (tau, a) coordinates and the number of iterations and function evaluations used are returned."""
         
-        #Calculating NLL values for each (tau, a) coordinate pair
-        TAU, A = np.meshgrid(tau, a)
-        ls = np.array([function(tau, a) for tau,a in zip(np.ravel(TAU), np.ravel(A))])
-        LS = ls.reshape(TAU.shape)
+        x = np.array([tauStart, aStart], dtype=float) #Starting coordinates in array
+        y, grads, hessian = self.funcs.bkgNllDerivatives(x[0], x[1])
+        evaluations = 1
+        iterations = 0
+        roundoff = nllRoundoff(self.funcs)
         
-        cp = plt.contour(TAU, A, LS, levels = [funcMin + 0.5]) #Creating contour level at NLLMin + 0.5
-        p = cp.collections[0].get_paths()[0]
-        v = p.vertices
+        while iterations < maxIter:
+            
+            freeGrads, free = freeGradients(x[1], grads) #a is held at the a = 1 boundary if the gradient points beyond it
+            
+            if np.max(np.abs(freeGrads)) < tol: #Stopping once the gradient is small enough
+                break
+            
+            step, descent, uphill = newtonStep(grads, hessian, free)
+            if not uphill and atRoundoff(descent, y, roundoff): #The Newton step promises a decrease below the rounding error of the NLL, as for large samples or float32 data where the gradient cannot reach tol
+                trial = x + step #The line search cannot check so small a decrease, so the final Newton step is taken as it is
+                trial[1] = min(trial[1], 1.)
+                if trial[0] > 0 and trial[1] > 0:
+                    x = trial
+                    y = self.funcs.bkgNll(x[0], x[1])
+                    evaluations += 1
+                    iterations += 1
+                break
+
+            for halving in range(LINE_SEARCH_HALVINGS): #Backtracking line search along the step direction
+                trial = x + 0.5**halving*step
+                trial[1] = min(trial[1], 1.) #Projecting a back onto its upper bound
+                if trial[0] > 0 and trial[1] > 0:
+                    yTrial = self.funcs.bkgNll(trial[0], trial[1])
+                    evaluations += 1
+                    if yTrial <= y + SUFFICIENT_DECREASE*np.dot(grads, trial - x): #Sufficient decrease condition
+                        break
+            else:
+                break #No further decrease can be found along this direction, so the minimum has been reached to machine precision
+                
+            stepSize = np.linalg.norm(trial - x)
+            x = trial
+            y, grads, hessian = self.funcs.bkgNllDerivatives(x[0], x[1])
+            evaluations += 1
+            iterations += 1
+            
+            if self.profiler is not None:
+                self.profiler.trace('bkgNewtonMinimiseNll', iterations, x[0], x[1], y, stepSize)
+            
+        return y, x[0], x[1], iterations, evaluations #NLL at minimum, (tau, a) coordinates at minimum and the work done returned
+        
+    def bkgError(self, tau, a=None, tauMin=None, aMin=None, funcMin=None, function=None):
+        """Calculates the errors in the optimum tau and a values from the minimised 2D NLL by analysing contour at NLLMin + 0.5.
+        The function may accept arrays of tau and a values (eg. Functions.bkgNllGrid), which is much faster, or single values (eg. Functions.bkgNll).
+        Alternatively tau can be an NllSurface, whose values are used without evaluating the function again.
+        If tauMin, aMin or funcMin are not given, they are taken from the lowest point of the grid."""
+        
+        from contourpy import contour_generator #Imported here so that the rest of the module can be used without contourpy (installed with matplotlib)
+        
+        #Calculating NLL values for all (tau, a) coordinate pairs at once, unless they are already held in a surface
+        surface = gridSurface(tau, a, function)
+        TAU, A, LS = surface.TAU, surface.A, surface.values
+        gridMin = surface.minimum
+        funcMin = gridMin[0] if funcMin is None else funcMin
+        tauMin = gridMin[1] if tauMin is None else tauMin
+        aMin = gridMin[2] if aMin is None else aMin
+        
+        #Creating contour level at NLLMin + 0.5 with the same algorithm as matplotlib's contour, but without a figure or a plotting backend
+        lines, codes = contour_generator(TAU, A, LS, name='mpl2014').lines(funcMin + 0.5)
+        v = lines[0] #Vertices of the first contour line
         #Lists of all tau  and a values on this contour
         tauPoints = v[:,0]
         aPoints = v[:,1]
         
-        plt.close()
+        if self.profiler is not None: #Each contour point counts as one iteration, with its distance from the minimum as the step
+            for i, (tauPoint, aPoint) in enumerate(zip(tauPoints, aPoints)):
+                self.profiler.trace('bkgError', i + 1, tauPoint, aPoint, funcMin + 0.5, np.hypot(tauPoint - tauMin, aPoint - aMin))
         
         plusTau = []
         minTau = []
@@ -212,4 +406,180 @@ class Minimiser(object):
         
         return posTauError, negTauError, posAError, negAError # Returning positive and negative errors for both tau and a
         
-            
\ No newline at end of file
+    def bkgContourError(self, tauMin, aMin, funcMin=None, method='rays', tol=1e-4, rays=16):
+        """Calculates the errors in the optimum tau and a values from the minimised 2D NLL without evaluating a grid, returning them in the same form as bkgError.
+        method='hessian' gives symmetric errors from the inverse of the analytic Hessian at the minimum.
+        method='rays' finds the NLLMin + 0.5 contour by root-finding along rays from the minimum, then refines the direction of the contour's furthest extent in tau and a.
+        method='profile' finds where the profile likelihood (the NLL minimised over the other parameter) reaches NLLMin + 0.5.
+        The rays and profile errors are found to within tol of the Hessian errors, and where the contour reaches the a = 1 boundary the positive a error stops there."""
+        
+        if funcMin is None:
+            funcMin = self.funcs.bkgNll(tauMin, aMin)
+        bkgNll = self._tracedBkgNll('bkgContourError', tauMin, aMin)
+        
+        hessian = self.funcs.bkgNllDerivatives(tauMin, aMin)[2]
+        scales = np.sqrt(np.diag(np.linalg.inv(hessian))) #Errors from the curvature at the minimum, used to scale the searches
+        
+        if method == 'hessian':
+            return scales[0], scales[0], scales[1], scales[1]
+        elif method == 'rays':
+            return self._rayErrors(tauMin, aMin, funcMin, scales, tol, rays, bkgNll)
+        elif method == 'profile':
+            return self._profileErrors(tauMin, aMin, funcMin, scales, tol, bkgNll)
+        else:
+            raise ValueError("method must be 'rays', 'profile' or 'hessian'")
+            
+    def _tracedBkgNll(self, routine, tauMin, aMin):
+        """Returns the 2D NLL function, which records every evaluation as an iteration of the routine when profiling, with its distance from the minimum as the step."""
+        
+        if self.profiler is None:
+            return self.funcs.bkgNll
+        
+        evaluations = [0]
+        
+        def bkgNll(tau, a):
+            nllValue = self.funcs.bkgNll(tau, a)
+            evaluations[0] += 1
+            self.profiler.trace(routine, evaluations[0], tau, a, nllValue, np.hypot(tau - tauMin, a - aMin))
+            return nllValue
+        
+        return bkgNll
+        
+    def _rayErrors(self, tauMin, aMin, funcMin, scales, tol, rays, bkgNll):
+        """Finds the extent of the NLLMin + 0.5 contour in tau and a from root-finding along rays out of the minimum."""
+        
+        def contourPoint(angle):
+            """Returns the (tau, a) point where the ray at this angle (in units of the Hessian errors) meets the contour or the a = 1 boundary."""
+            
+            direction = scales*np.array([np.cos(angle), np.sin(angle)])
+            limit = (1 - aMin)/direction[1] if direction[1] > 0 else np.inf #Distance along the ray to the a = 1 boundary
+            
+            def shiftNll(r):
+                point = np.array([tauMin, aMin]) + r*direction
+                return bkgNll(point[0], point[1]) - funcMin - 0.5
+            
+            r = 1.5 #Bracketing the crossing, which is near r = 1 for a close to parabolic NLL
+            while r < limit and shiftNll(r) < 0:
+                r *= 2
+            if r >= limit and shiftNll(limit) < 0: #The contour is cut off by the a = 1 boundary
+                r = limit
+            else:
+                r = brentq(shiftNll, 0, min(r, limit), xtol=tol)
+                
+            return np.array([tauMin, aMin]) + r*direction
+            
+        angles = np.linspace(0, 2*np.pi, rays, endpoint=False)
+        points = np.array([contourPoint(angle) for angle in angles])
+        spacing = angles[1] - angles[0]
+        
+        errors = []
+        for parameter, centre in enumerate([tauMin, aMin]):
+            for sign in [1, -1]: #Refining the direction of the furthest contour point above and below the minimum
+                best = angles[np.argmax(sign*points[:, parameter])]
+                result = minimize_scalar(lambda angle: -sign*contourPoint(angle)[parameter], bounds=(best - spacing, best + spacing), method='bounded', options={'xatol': tol})
+                errors.append(abs(-result.fun*sign - centre))
+                
+        return tuple(errors) #Positive and negative errors for tau, then a
+        
+    def _profileErrors(self, tauMin, aMin, funcMin, scales, tol, bkgNll):
+        """Finds the profile likelihood intervals of tau and a at NLLMin + 0.5."""
+        
+        def profileTau(tau):
+            """NLL at this tau, minimised over a."""
+            return minimize_scalar(lambda a: bkgNll(tau, a), bounds=(max(aMin - 20*scales[1], 1e-6), 1.), method='bounded', options={'xatol': tol*scales[1]}).fun
+            
+        def profileA(a):
+            """NLL at this a, minimised over tau."""
+            return minimize_scalar(lambda tau: bkgNll(tau, a), bounds=(max(tauMin - 20*scales[0], 1e-6), tauMin + 20*scales[0]), method='bounded', options={'xatol': tol*scales[0]}).fun
+            
+        errors = []
+        for profile, centre, scale, upper in [(profileTau, tauMin, scales[0], np.inf), (profileA, aMin, scales[1], 1.)]:
+            for sign in [1, -1]:
+                limit = (upper - centre) if sign > 0 else np.inf #Distance to the a = 1 boundary
+                step = 1.5*scale
+                while step < limit and profile(centre + sign*step) - funcMin - 0.5 < 0: #Bracketing the crossing
+                    step *= 2
+                if step >= limit and profile(centre + sign*limit) - funcMin - 0.5 < 0: #The interval is cut off by the a = 1 boundary
+                    errors.append(limit)
+                else:
+                    root = brentq(lambda value: profile(value) - funcMin - 0.5, centre, centre + sign*min(step, limit), xtol=tol*scale)
+                    errors.append(abs(root - centre))
+                    
+        return tuple(errors) #Positive and negative errors for tau, then a
+
+
+SUFFICIENT_DECREASE = 1e-4 #Fraction of the decrease expected from the gradient that a line search step must achieve
+LINE_SEARCH_HALVINGS = 34 #Trial steps of a line search, from the full step down to 2**-33 of it
+
+
+def nllRoundoff(funcs):
+    """Returns the relative rounding error of the NLL functions, larger for float32 data, below which the Newton methods stop trying to lower the NLL."""
+    
+    return 1e-15*getattr(funcs, 'precision', np.finfo(float).eps)/np.finfo(float).eps
+
+def freeGradients(a, grads):
+    """Returns the gradients with the a component set to zero where a is held at the a = 1 boundary (as the gradient points beyond it), and where a is free.
+    a may be a single value or an array of one value per dataset, with grads of shape (2,) or (2, datasets) as from Functions.bkgNllDerivatives."""
+    
+    free = ~((a >= 1) & (grads[1] < 0))
+    
+    return np.array([grads[0], np.where(free, grads[1], 0.)]), free
+
+def newtonStep(grads, hessian, free):
+    """Returns the Newton step in (tau, a) for one dataset or a batch of them, the change in NLL it predicts from the gradient, and where it was replaced as not downhill.
+    Where a is not free the step is in tau alone. Where the Hessian is not positive definite, a gradient descent step scaled by the diagonal of the Hessian is used instead.
+    The shapes are as for freeGradients, with hessian of shape (2, 2) or (2, 2, datasets)."""
+    
+    try:
+        step = -np.moveaxis(np.linalg.solve(np.moveaxis(hessian, (0, 1), (-2, -1)), np.moveaxis(grads, 0, -1)[..., np.newaxis])[..., 0], -1, 0)
+    except np.linalg.LinAlgError: #A singular Hessian, so descending the gradient instead
+        step = np.full(np.shape(grads), np.nan)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        step = np.array([np.where(free, step[0], -grads[0]/hessian[0, 0]), np.where(free, step[1], 0.)])
+    
+    descent = step[0]*grads[0] + step[1]*grads[1]
+    uphill = ~np.isfinite(descent) | (descent >= 0)
+    freeGrads = np.array([grads[0], np.where(free, grads[1], 0.)])
+    step = np.where(uphill, -freeGrads/np.maximum(np.abs(np.array([hessian[0, 0], hessian[1, 1]])), 1e-8), step)
+    
+    return step, descent, uphill
+
+def atRoundoff(descent, nll, roundoff):
+    """Returns whether a Newton step's predicted change in NLL is below the rounding error of the NLL, so it has reached its minimum as closely as it can be resolved."""
+    
+    return -0.5*descent < roundoff*np.abs(nll)
+
+
+def _fitSubsets(times, errors, sizes, warmStart=False):
+    """Calculates the parabolic error in the optimum tau value for each subset size in turn.
+    Each subset is a prefix view of the full times and errors arrays, so no data is copied."""
+    
+    sizeErrors = []
+    x = [0.3, 0.4, 0.5]
+    
+    for i in sizes:
+        
+        meanSigma = np.mean(errors[:i]) #Calculating the mean sigma from all the errors of the data subset
+        minim = Minimiser(times[:i], errors[:i], meanSigma) #Instantiating Minimiser object for the required data subset
+        
+        tauMin, nllMin, x, y = minim.minimiseNll(x, 1e-5) #Calculating the NLL minimum, along with the last parabolic estimate
+        sizeErrors.append(minim.parabError(x, y)) #Calculating error in best estimate of tau using parabolic approach
+        
+        x = [tauMin - 0.02, tauMin, tauMin + 0.02] if warmStart else [0.3, 0.4, 0.5] #Starting points for the next subset
+        
+    return sizeErrors
+    
+_subsetData = {} #Full dataset held by each errorVSReadings worker process
+
+def _initSubsetWorker(times, errors):
+    """Stores the full dataset in an errorVSReadings worker process."""
+    
+    _subsetData['times'] = times
+    _subsetData['errors'] = errors
+    
+def _fitSubsetsInWorker(args):
+    """Fits a block of subset sizes inside an errorVSReadings worker process."""
+    
+    sizes, warmStart = args
+    
+    return _fitSubsets(_subsetData['times'], _subsetData['errors'], sizes, warmStart)
\ No newline at end of file
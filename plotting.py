@@ -2,18 +2,29 @@ from matplotlib import pyplot as plt
 import numpy as np
 from matplotlib import cm
 from mpl_toolkits.mplot3d import Axes3D
+from surface import gridSurface
 
 """This module is strictly used for plotting various graphs.
-This includes creating and plotting figures of histograms, 2D plots, 3D surface plots and contour plots"""
+This includes creating and plotting figures of histograms, 2D plots, 3D surface plots and contour plots.
+Every plotting function shows its figure, unless a filename is given in which case the figure is saved there instead."""
 
-def plotHist(times, bins=100, sortedTimes=None, pdfs=None,):
+def showOrSave(filename=None):
+    """Shows the current figure, or saves it to the file and closes it if a filename is given."""
+    
+    if filename is None:
+        plt.show()
+    else:
+        plt.savefig(filename)
+        plt.close()
+
+def plotHist(times, bins=100, sortedTimes=None, pdfs=None, filename=None):
     """Plots a histogram of the raw data. Also includes pdf plots, if specified"""
     
     plt.figure()
     if pdfs is None and sortedTimes is None:
-        plt.hist(times, bins=bins, normed=True) #Plotting just the histogram of raw if no pdfs input
+        plt.hist(times, bins=bins, density=True) #Plotting just the histogram of raw if no pdfs input
     else:
-        plt.hist(times, bins=bins, color= 'orange', normed=True, label='Raw Data') #Plotting normalised histogram with specified number of bins
+        plt.hist(times, bins=bins, color= 'orange', density=True, label='Raw Data') #Plotting normalised histogram with specified number of bins
         plt.plot(sortedTimes, pdfs[1], color='cyan', linewidth=2, label='Tau = 0.4097ps') #Plotting pdf with background correction
         plt.plot(sortedTimes, pdfs[0], color='green', linewidth=2, label='Tau = 0.4045ps') #Plotting pdf with no background correction
     plt.title('Histrogram of decay times for 10,000 D0 Samples with Sigma=0.282')
@@ -21,10 +32,10 @@ def plotHist(times, bins=100, sortedTimes=None, pdfs=None,):
     plt.ylabel('Probability Density')
     plt.grid()
     plt.legend()
-    plt.show()
+    showOrSave(filename)
     
     
-def plotPDF(times, pdf):
+def plotPDF(times, pdf, filename=None):
     """Plots a PDF over time."""
     
     # Plotting the input PDF function against time
@@ -34,9 +45,9 @@ def plotPDF(times, pdf):
     plt.xlabel('Decay Time (picoseconds)')
     plt.ylabel('PDF')
     plt.grid()
-    plt.show()
+    showOrSave(filename)
     
-def plotNLL(taus, likelihoods, tauMin = None, nllMin = None):
+def plotNLL(taus, likelihoods, tauMin = None, nllMin = None, filename=None):
     """Plots a 1D NLL function against varying parameter values ie tau."""
     
     #Plotting NLL function against tau
@@ -49,9 +60,9 @@ def plotNLL(taus, likelihoods, tauMin = None, nllMin = None):
     plt.ylabel('NLL')
     plt.grid()
     plt.legend()
-    plt.show()
+    showOrSave(filename)
     
-def plotErrorsVSReadings(sizes, sizeErrors, lowerLimit=2.5, upperLimit=6.1):
+def plotErrorsVSReadings(sizes, sizeErrors, lowerLimit=2.5, upperLimit=6.1, filename=None):
     """Plots variation of error in tau value against number of readings in data set (on log plot).
     Also extroplates the data to find the number of readings required for accuracy of 1fs."""
     
@@ -88,18 +99,19 @@ def plotErrorsVSReadings(sizes, sizeErrors, lowerLimit=2.5, upperLimit=6.1):
     plt.ylabel('Base 10 log(Error (picoseconds))')
     plt.grid()
     plt.legend()
-    plt.show()
+    showOrSave(filename)
     
     return intersect, m, c
     
     
-def plot3D(tau, a, function):
-    """Plots a 2D NLL function (in 3D space) against varying parameter values ie tau and a."""
+def plot3D(tau, a=None, function=None, filename=None):
+    """Plots a 2D NLL function (in 3D space) against varying parameter values ie tau and a.
+    The function may accept arrays of tau and a values (eg. Functions.bkgNllGrid), which is much faster, or single values (eg. Functions.bkgNll).
+    Alternatively tau can be an NllSurface, whose values are plotted without evaluating the function again."""
     
-    #Calculating NLL values for each (tau, a) coordinate pair
-    TAU, A = np.meshgrid(tau, a)
-    ls = np.array([function(tau, a) for tau,a in zip(np.ravel(TAU), np.ravel(A))])
-    LS = ls.reshape(TAU.shape)
+    #Calculating NLL values for all (tau, a) coordinate pairs at once, unless they are already held in a surface
+    surface = gridSurface(tau, a, function)
+    TAU, A, LS = surface.TAU, surface.A, surface.values
     
     #Plotting the NLL surface in 3D space
     fig = plt.figure()
@@ -109,15 +121,16 @@ def plot3D(tau, a, function):
     ax.set_xlabel('tau (picoseconds)')
     ax.set_ylabel('a')
     ax.set_zlabel('NLL')
-    plt.show()
+    showOrSave(filename)
     
-def plotContour(tau, a, function, levels =None):
-    """Plots contours of the 2D NLL function against varying parameter values ie tau and a."""
+def plotContour(tau, a=None, function=None, levels =None, filename=None):
+    """Plots contours of the 2D NLL function against varying parameter values ie tau and a.
+    The function may accept arrays of tau and a values (eg. Functions.bkgNllGrid), which is much faster, or single values (eg. Functions.bkgNll).
+    Alternatively tau can be an NllSurface, whose values are plotted without evaluating the function again."""
     
-    #Calculating NLL values for each (tau, a) coordinate pair
-    TAU, A = np.meshgrid(tau, a)
-    ls = np.array([function(tau, a) for tau,a in zip(np.ravel(TAU), np.ravel(A))])
-    LS = ls.reshape(TAU.shape)
+    #Calculating NLL values for all (tau, a) coordinate pairs at once, unless they are already held in a surface
+    surface = gridSurface(tau, a, function)
+    TAU, A, LS = surface.TAU, surface.A, surface.values
     
     #Plotting the 2D NLL surface contours
     plt.figure()
@@ -130,4 +143,4 @@ def plotContour(tau, a, function, levels =None):
     plt.title('Contour Plot of NLL in proximity of minimum')
     plt.xlabel('tau (picoseconds)')
     plt.ylabel('a')
-    plt.show()      
\ No newline at end of file
+    showOrSave(filename)      
\ No newline at end of file
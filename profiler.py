@@ -0,0 +1,115 @@
+import csv
+import json
+from timeit import default_timer
+
+"""This module records how much work the minimisers do, for profiling slow fits.
+A Profiler counts and times every call to the NLL functions and stores a trace of each minimiser iteration.
+It is switched on for a Minimiser with Minimiser.enableProfiling, and has no cost when it is not enabled."""
+
+
+PROFILED_FUNCTIONS = ['nll', 'bkgNll', 'bkgNllDerivatives', 'bkgNllGrid'] #NLL functions counted and timed by a Profiler
+
+
+class Profiler(object):
+
+    """Stores call counts, cumulative times and iteration traces for a set of fits."""
+
+    def __init__(self):
+        self.calls = {}
+        self.seconds = {}
+        self.traces = []
+
+    def reset(self):
+        """Clears everything recorded so far."""
+
+        self.calls = {}
+        self.seconds = {}
+        self.traces = []
+
+    def wrap(self, funcs):
+        """Returns a ProfiledFunctions object which counts and times the NLL function calls made on funcs."""
+
+        return ProfiledFunctions(funcs, self)
+
+    def record(self, name, seconds):
+        """Records one call of the named function taking the given time."""
+
+        self.calls[name] = self.calls.get(name, 0) + 1
+        self.seconds[name] = self.seconds.get(name, 0.) + seconds
+
+    def trace(self, routine, iteration, tau, a, nll, step):
+        """Records one iteration of a minimiser or error routine, with the parameters reached (a is None for 1D routines), the NLL there and the step size."""
+
+        self.traces.append({
+            'routine': routine,
+            'iteration': int(iteration),
+            'tau': float(tau),
+            'a': None if a is None else float(a),
+            'nll': float(nll),
+            'step': float(step),
+        })
+
+    def iterations(self):
+        """Returns the number of traced iterations for each routine."""
+
+        counts = {}
+        for entry in self.traces:
+            counts[entry['routine']] = counts.get(entry['routine'], 0) + 1
+
+        return counts
+
+    def summary(self):
+        """Returns a text table of the calls and time spent in each NLL function, followed by the iterations of each routine."""
+
+        lines = ['%-20s %10s %12s %12s' % ('function', 'calls', 'total (s)', 'mean (ms)')]
+        for name in sorted(self.calls):
+            lines.append('%-20s %10d %12.4f %12.4f' % (name, self.calls[name], self.seconds[name], 1e3*self.seconds[name]/self.calls[name]))
+
+        lines.append('')
+        lines.append('%-20s %10s' % ('routine', 'iterations'))
+        for routine, count in sorted(self.iterations().items()):
+            lines.append('%-20s %10d' % (routine, count))
+
+        return '\n'.join(lines)
+
+    def toJson(self, filename):
+        """Writes the call counts, times and traces to a JSON file."""
+
+        with open(filename, 'w') as f:
+            json.dump({'calls': self.calls, 'seconds': self.seconds, 'traces': self.traces}, f, indent=2, sort_keys=True)
+
+    def toCsv(self, filename):
+        """Writes the iteration traces to a CSV file, one row per iteration."""
+
+        fields = ['routine', 'iteration', 'tau', 'a', 'nll', 'step']
+        with open(filename, 'w') as f:
+            writer = csv.DictWriter(f, fields)
+            writer.writeheader()
+            writer.writerows(self.traces)
+
+
+class ProfiledFunctions(object):
+
+    """Stands in for a Functions object, passing every call through to it whilst counting and timing the NLL functions."""
+
+    def __init__(self, funcs, profiler):
+        self.funcs = funcs
+        self.profiler = profiler
+
+        for name in PROFILED_FUNCTIONS:
+            if hasattr(funcs, name):
+                setattr(self, name, self._timed(name, getattr(funcs, name)))
+
+    def _timed(self, name, function):
+        """Returns a version of function which records each call in the profiler."""
+
+        def timedFunction(*args, **kwargs):
+            start = default_timer()
+            result = function(*args, **kwargs)
+            self.profiler.record(name, default_timer() - start)
+            return result
+
+        return timedFunction
+
+    def __getattr__(self, name):
+        return getattr(self.funcs, name) #Everything else is taken from the wrapped object
@@ -0,0 +1,133 @@
+import threading
+import time
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+
+"""This module runs the stages of an analysis as a graph of tasks, each starting as soon as the stages it depends on have finished.
+Independent stages run at the same time on a thread pool (numpy and scipy release the GIL in the NLL calculations), or on a process pool for functions which can be pickled.
+The wall time of every stage is recorded, along with the critical path: the chain of dependent stages which sets the total time."""
+
+
+class Scheduler(object):
+
+    """A graph of named tasks, run in parallel in dependency order."""
+
+    def __init__(self, workers=None, processes=False):
+        self.workers = workers if workers else multiprocessing.cpu_count()
+        self.processes = processes #Process pools need functions and results which can be pickled
+        self.tasks = {}
+        self.order = [] #Names in the order added, which is also the order ready tasks are started
+        self.results = {}
+        self.started = {} #Start and end times of each task, in seconds from the start of the run
+        self.finished = {}
+        self.wallTime = None
+
+    def add(self, name, function, dependencies=(), mainThread=False):
+        """Adds a task, which is called with the results of its dependencies (in the order given) once they have all finished.
+        Tasks with mainThread are run by the thread calling run rather than on the pool, eg. for matplotlib, which is not thread-safe."""
+
+        for dependency in dependencies:
+            if dependency not in self.tasks:
+                raise ValueError("task %s depends on %s, which has not been added" % (name, dependency))
+
+        self.tasks[name] = (function, list(dependencies), mainThread)
+        self.order.append(name)
+
+    def run(self):
+        """Runs every task and returns a dictionary of their results. The first exception raised by a task is raised again here once running tasks have finished."""
+
+        condition = threading.Condition()
+        done = []
+
+        def finish(name):
+            def callback(outcome):
+                with condition:
+                    done.append((name, outcome))
+                    condition.notify()
+            return callback
+
+        pool = multiprocessing.Pool(self.workers) if self.processes else ThreadPool(self.workers)
+        start = time.time()
+        waiting = list(self.order)
+        running = 0
+        failure = None
+
+        try:
+            while waiting or running:
+                if failure is None: #Starting every task whose dependencies have all finished, with those for the pool first so they run alongside any for this thread
+                    ready = [name for name in waiting if all(dependency in self.results for dependency in self.tasks[name][1])]
+                    for name in sorted(ready, key=lambda name: self.tasks[name][2]):
+                        function, dependencies, mainThread = self.tasks[name]
+                        args = [self.results[dependency] for dependency in dependencies]
+                        waiting.remove(name)
+                        running += 1
+                        if mainThread:
+                            finish(name)(_callTask(function, args))
+                        else:
+                            pool.apply_async(_callTask, (function, args), callback=finish(name))
+                elif not running:
+                    break
+
+                with condition:
+                    while not done:
+                        condition.wait()
+                    name, (succeeded, result, taskStart, taskEnd) = done.pop(0)
+                running -= 1
+
+                self.started[name] = taskStart - start
+                self.finished[name] = taskEnd - start
+                if succeeded:
+                    self.results[name] = result
+                elif failure is None:
+                    failure = result
+        finally:
+            pool.close()
+            pool.join()
+
+        self.wallTime = time.time() - start
+        if failure is not None:
+            raise failure
+
+        return self.results
+
+    def seconds(self, name):
+        """Returns the wall time of a finished task."""
+
+        return self.finished[name] - self.started[name]
+
+    def criticalPath(self):
+        """Returns the chain of dependent tasks with the longest total wall time, and that time."""
+
+        longest = {} #Longest chain ending at each task, with its total time
+        for name in self.order: #Tasks can only depend on those added before them
+            chains = [longest[dependency] for dependency in self.tasks[name][1]]
+            chain, total = max(chains, key=lambda item: item[1]) if chains else ([], 0.)
+            longest[name] = (chain + [name], total + self.seconds(name))
+
+        return max(longest.values(), key=lambda item: item[1])
+
+    def summary(self):
+        """Returns a text table of the start time and wall time of every task, followed by the critical path."""
+
+        lines = ['%-20s %10s %10s' % ('stage', 'start (s)', 'time (s)')]
+        for name in sorted(self.order, key=lambda name: self.started[name]):
+            lines.append('%-20s %10.3f %10.3f' % (name, self.started[name], self.seconds(name)))
+
+        path, total = self.criticalPath()
+        lines.append('')
+        lines.append('Critical path (%.3fs): %s' % (total, ' -> '.join(path)))
+        lines.append('Total wall time %.3fs, against %.3fs for the stages run one after another' % (self.wallTime, sum(self.seconds(name) for name in self.order)))
+
+        return '\n'.join(lines)
+
+
+def _callTask(function, args):
+    """Calls a task's function inside a pool worker, returning whether it succeeded, its result (or exception), and its start and end times."""
+
+    start = time.time()
+    try:
+        result = function(*args)
+    except Exception as error:
+        return False, error, start, time.time()
+
+    return True, result, start, time.time()
@@ -0,0 +1,60 @@
+import numpy as np
+
+"""This module holds the 2D NLL evaluated over a grid of tau and a values, so that one evaluation can be shared.
+An NllSurface is passed to plotting.plotContour, plotting.plot3D and Minimiser.bkgError in place of a function, so the grid is only calculated once.
+It can also be refined, evaluating a finer grid around its minimum only."""
+
+
+class NllSurface(object):
+
+    """The values of a 2D NLL function over a grid of tau and a values, with the grid point of lowest NLL."""
+
+    def __init__(self, tau, a, function):
+        """The function is called with the whole grids of tau and a values if it accepts arrays (eg. Functions.bkgNllGrid).
+        Otherwise (eg. Functions.bkgNll) it is evaluated at one grid point at a time."""
+
+        self.tau = np.asarray(tau, dtype=float) #Axes of the grid
+        self.a = np.asarray(a, dtype=float)
+        self.function = function
+
+        self.TAU, self.A = np.meshgrid(self.tau, self.a)
+        self.values = _evaluate(function, self.TAU, self.A) #NLL at every grid point, with rows of constant a
+
+        row, column = np.unravel_index(np.argmin(self.values), self.values.shape)
+        self.minimum = (self.values[row, column], self.tau[column], self.a[row]) #NLL, tau and a at the lowest grid point, in the same order as Minimiser.bkgNewtonMinimiseNll
+        self._index = (row, column)
+
+    def refine(self, points=None, width=2):
+        """Returns a new NllSurface over a finer grid spanning width grid steps either side of the minimum, kept within the original grid.
+        The new grid has the given number of points along each axis, or as many as this one by default."""
+
+        axes = []
+        for axis, index in [(self.tau, self._index[1]), (self.a, self._index[0])]:
+            lower = axis[max(index - width, 0)]
+            upper = axis[min(index + width, len(axis) - 1)]
+            axes.append(np.linspace(lower, upper, len(axis) if points is None else points))
+
+        return NllSurface(axes[0], axes[1], self.function)
+
+
+def _evaluate(function, TAU, A):
+    """Returns function over the grids of tau and a, calling it once with the whole grids if it can take arrays, or once per point if not."""
+
+    try:
+        values = np.asarray(function(TAU, A))
+    except (ValueError, TypeError): #Functions of single values fail to broadcast the grids against the readings
+        values = None
+
+    if values is None or values.shape != TAU.shape:
+        values = np.vectorize(function, otypes=[float])(TAU, A)
+
+    return values
+
+
+def gridSurface(tau, a=None, function=None):
+    """Returns tau if it is already an NllSurface, otherwise evaluates a new NllSurface from the tau and a axes and the function."""
+
+    if isinstance(tau, NllSurface):
+        return tau
+
+    return NllSurface(tau, a, function)
@@ -0,0 +1,128 @@
+import numpy as np
+import os
+
+import cache
+from cache import ResultCache
+
+"""Tests of the on-disk result cache: keys, least recently used eviction and invalidation.
+Run with python -m pytest."""
+
+
+def makeData(directory, name, text):
+    filename = str(directory.joinpath(name))
+    with open(filename, 'w') as f:
+        f.write(text)
+    return filename
+
+def age(path, seconds):
+    """Sets the last use of a cached result to this many seconds ago."""
+
+    used = os.stat(path).st_mtime - seconds
+    os.utime(path, (used, used))
+
+
+def test_roundTrip(tmp_path):
+    results = ResultCache(str(tmp_path.joinpath('cache')))
+    filename = makeData(tmp_path, 'data.txt', '0.1 0.3\n')
+
+    key = results.key(filename, 'fit', (0.4, 0.9))
+    assert results.get(key) is None
+
+    results.put(key, (1.5, np.arange(3.), 7))
+    nll, values, iterations = results.get(key)
+    assert nll == 1.5 and iterations == 7
+    assert np.array_equal(values, np.arange(3.))
+
+    results.put(key, 2.5)
+    assert results.get(key) == 2.5
+
+def test_cachedComputesOnce(tmp_path):
+    results = ResultCache(str(tmp_path.joinpath('cache')))
+    filename = makeData(tmp_path, 'data.txt', '0.1 0.3\n')
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return 3.
+
+    assert results.cached(filename, 'fit', (0.4,), compute) == 3.
+    assert results.cached(filename, 'fit', (np.float64(0.4),), compute) == 3. #Equal numpy and Python numbers share a key
+    assert len(calls) == 1
+
+    results.cached(filename, 'fit', (0.5,), compute)
+    assert len(calls) == 2
+
+def test_keyFollowsDataContent(tmp_path):
+    results = ResultCache(str(tmp_path.joinpath('cache')))
+    filename = makeData(tmp_path, 'data.txt', '0.1 0.3\n')
+    key = results.key(filename, 'fit', ())
+
+    os.utime(filename, (0, 0)) #Touched but unchanged
+    assert results.key(filename, 'fit', ()) == key
+
+    makeData(tmp_path, 'data.txt', '0.2 0.3\n')
+    os.utime(filename, (1, 1))
+    assert results.key(filename, 'fit', ()) != key
+
+def test_evictsLeastRecentlyUsed(tmp_path):
+    results = ResultCache(str(tmp_path.joinpath('cache')))
+    filename = makeData(tmp_path, 'data.txt', '0.1 0.3\n')
+    keys = [results.key(filename, 'grid', (i,)) for i in range(3)]
+
+    for i, key in enumerate(keys):
+        results.put(key, np.zeros(1000))
+        age(results._path(key), 100*(3 - i)) #The first result is the oldest
+    results.get(keys[0]) #Using the oldest result makes it the most recent
+
+    assert results.entries() == [results._path(keys[1]), results._path(keys[2]), results._path(keys[0])]
+
+    results.maxBytes = results.size() - 1
+    results.evict()
+
+    assert results.get(keys[1]) is None
+    assert results.get(keys[0]) is not None and results.get(keys[2]) is not None
+    assert results.size() <= results.maxBytes
+
+def test_putKeepsWithinLimit(tmp_path):
+    results = ResultCache(str(tmp_path.joinpath('cache')), maxBytes=0)
+    filename = makeData(tmp_path, 'data.txt', '0.1 0.3\n')
+
+    results.put(results.key(filename, 'grid', ()), np.zeros(1000))
+    assert results.entries() == []
+
+def test_invalidate(tmp_path):
+    results = ResultCache(str(tmp_path.joinpath('cache')))
+    first = makeData(tmp_path, 'first.txt', '0.1 0.3\n')
+    second = makeData(tmp_path, 'second.txt', '0.2 0.3\n')
+
+    firstKey = results.key(first, 'fit', ())
+    secondKey = results.key(second, 'fit', ())
+    results.put(firstKey, 1.)
+    results.put(secondKey, 2.)
+
+    results.invalidate(first)
+    assert results.get(firstKey) is None
+    assert results.get(secondKey) == 2.
+
+    results.invalidate()
+    assert results.entries() == []
+
+def test_codeChangeInvalidates(tmp_path, monkeypatch):
+    source = tmp_path.joinpath('source')
+    source.mkdir()
+    for name in cache.CODE_FILES:
+        makeData(source, name, '#%s\n' % name)
+    monkeypatch.setattr(cache, '__file__', str(source.joinpath('cache.py'))) #The modules are found next to cache.py
+
+    filename = makeData(tmp_path, 'data.txt', '0.1 0.3\n')
+    results = ResultCache(str(tmp_path.joinpath('cache')))
+    key = results.key(filename, 'fit', ())
+    results.put(key, 1.)
+
+    assert ResultCache(str(tmp_path.joinpath('cache'))).get(key) == 1.
+
+    makeData(source, 'functions.py', '#functions.py, edited\n')
+    edited = ResultCache(str(tmp_path.joinpath('cache')))
+    assert edited.codeHash != results.codeHash
+    assert edited.key(filename, 'fit', ()) != key
+    assert edited.cached(filename, 'fit', (), lambda: 2.) == 2.
@@ -0,0 +1,76 @@
+import numpy as np
+
+from follow import GrowingColumns, FileTail, LiveFitter
+
+"""Tests of following a lifetime file while it is written: the appended arrays, reading partly written lines and refitting.
+Run with python -m pytest."""
+
+
+def append(filename, text):
+    with open(filename, 'a') as f:
+        f.write(text)
+
+
+def test_growingColumns():
+    columns = GrowingColumns(capacity=2)
+    values = np.arange(20.).reshape(2, 10)
+
+    for start in range(0, 10, 3):
+        columns.extend(values[:, start:start + 3])
+
+    assert columns.size == 10
+    assert np.array_equal(columns.times, values[0])
+    assert np.array_equal(columns.errors, values[1])
+
+def test_splitLine(tmp_path):
+    filename = str(tmp_path.joinpath('live.txt'))
+    append(filename, '0.1 0.3\n0.2 0.')
+    tail = FileTail(filename)
+
+    assert np.array_equal(tail.read(), [[0.1], [0.3]])
+    assert tail.read().shape == (2, 0) #The partly written line is held back however often it is read
+
+    append(filename, '28\n0.3 0.3\n')
+    assert np.array_equal(tail.read(), [[0.2, 0.3], [0.28, 0.3]])
+
+def test_finalRead(tmp_path):
+    filename = str(tmp_path.joinpath('live.txt'))
+    append(filename, '0.1 0.3\n0.2 0.28')
+    tail = FileTail(filename)
+
+    assert np.array_equal(tail.read(), [[0.1], [0.3]])
+    assert np.array_equal(tail.read(final=True), [[0.2], [0.28]])
+    assert tail.read(final=True).shape == (2, 0)
+
+def test_truncated(tmp_path):
+    filename = str(tmp_path.joinpath('live.txt'))
+    append(filename, '0.1 0.3\n0.2 0.3\n')
+    tail = FileTail(filename)
+    tail.read()
+
+    with open(filename, 'w') as f: #Replaced by a new run
+        f.write('0.5 0.3\n')
+    assert tail.truncated()
+
+    tail.reset()
+    assert np.array_equal(tail.read(), [[0.5], [0.3]])
+
+def test_liveFitMatchesFile(tmp_path):
+    with open('lifetime.txt', 'r') as f:
+        lines = f.read().splitlines()[:2000]
+    filename = str(tmp_path.joinpath('live.txt'))
+    fitter = LiveFitter(filename)
+
+    append(filename, '\n'.join(lines[:1000]) + '\n' + lines[1000][:4])
+    first = fitter.update()
+    assert first['readings'] == 1000
+
+    append(filename, lines[1000][4:] + '\n' + '\n'.join(lines[1001:]))
+    assert fitter.update()['readings'] == 1999
+    final = fitter.update(final=True)
+    assert final['readings'] == 2000 and final['newReadings'] == 1
+    assert fitter.update(final=True) is None
+
+    whole = LiveFitter(filename).update(final=True)
+    assert abs(final['tau'] - whole['tau']) < 1e-3*whole['tauError']
+    assert abs(final['a'] - whole['a']) < 1e-3*whole['aError']
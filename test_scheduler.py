@@ -0,0 +1,93 @@
+import threading
+import time
+
+import pytest
+
+from scheduler import Scheduler
+
+"""Tests of the task graph scheduler: dependency order, failures and timing.
+Run with python -m pytest."""
+
+
+def square(x):
+    return x*x
+
+def fail(*args):
+    raise RuntimeError('stage failed')
+
+
+def test_dependencyOrder():
+    scheduler = Scheduler(workers=2)
+    scheduler.add('data', lambda: 3)
+    scheduler.add('square', lambda x: x*x, ['data'])
+    scheduler.add('double', lambda x: 2*x, ['data'])
+    scheduler.add('total', lambda x, y: x - y, ['square', 'double']) #Called with the results in the order given
+
+    results = scheduler.run()
+
+    assert results == {'data': 3, 'square': 9, 'double': 6, 'total': 3}
+    for name in ['square', 'double']:
+        assert scheduler.started[name] >= scheduler.finished['data']
+        assert scheduler.started['total'] >= scheduler.finished[name]
+
+def test_mainThread():
+    threads = {}
+    scheduler = Scheduler(workers=2)
+    scheduler.add('pool', lambda: threads.setdefault('pool', threading.current_thread()))
+    scheduler.add('main', lambda thread: threads.setdefault('main', threading.current_thread()), ['pool'], mainThread=True)
+    scheduler.run()
+
+    assert threads['main'] is threading.current_thread()
+    assert threads['pool'] is not threading.current_thread()
+
+def test_missingDependency():
+    scheduler = Scheduler(workers=1)
+    with pytest.raises(ValueError):
+        scheduler.add('fit', lambda data: data, ['data'])
+
+@pytest.mark.parametrize('mainThread', [False, True])
+def test_failurePropagates(mainThread):
+    calls = []
+    scheduler = Scheduler(workers=2)
+    scheduler.add('data', lambda: 1)
+    scheduler.add('fit', fail, ['data'], mainThread=mainThread)
+    scheduler.add('slow', lambda x: time.sleep(0.2) or calls.append('slow'), ['data'])
+    scheduler.add('plot', lambda x: calls.append('plot'), ['fit'])
+
+    with pytest.raises(RuntimeError, match='stage failed'):
+        scheduler.run()
+
+    assert 'plot' not in calls #Tasks depending on the failed one are never started
+    assert calls == ['slow'] #Running tasks are finished before the failure is raised again
+    assert 'fit' in scheduler.finished and 'plot' not in scheduler.started
+
+def test_firstFailureRaised():
+    def missing():
+        raise KeyError('second')
+
+    scheduler = Scheduler(workers=1) #One worker runs the tasks in the order added
+    scheduler.add('first', fail)
+    scheduler.add('second', missing)
+
+    with pytest.raises(RuntimeError):
+        scheduler.run()
+
+def test_processes():
+    scheduler = Scheduler(workers=2, processes=True)
+    scheduler.add('data', int) #Functions run on a process pool must be picklable, so they are defined at module level
+    scheduler.add('square', square, ['data'])
+
+    assert scheduler.run() == {'data': 0, 'square': 0}
+
+def test_criticalPath():
+    scheduler = Scheduler(workers=2)
+    scheduler.add('data', lambda: time.sleep(0.05))
+    scheduler.add('short', lambda x: None, ['data'])
+    scheduler.add('long', lambda x: time.sleep(0.1), ['data'])
+    scheduler.add('end', lambda x, y: None, ['short', 'long'])
+    scheduler.run()
+
+    path, total = scheduler.criticalPath()
+    assert path == ['data', 'long', 'end']
+    assert total >= 0.15
+    assert 'Critical path' in scheduler.summary()
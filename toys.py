@@ -0,0 +1,148 @@
+import numpy as np
+import multiprocessing
+
+from data import generateData
+from functions import Functions
+from minimiser import nllRoundoff, freeGradients, newtonStep, atRoundoff, SUFFICIENT_DECREASE, LINE_SEARCH_HALVINGS
+
+"""This module validates the fits with pseudo-experiments (toy Monte Carlo).
+Toy datasets are either generated from the fitted PDF with background, or bootstrap-resampled from the real times and errors.
+The toys are fitted in batches, with many datasets stacked as rows of one array so each Newton iteration is a single array pass.
+Batches can be run on a process pool, and every batch has its own seed so the results do not depend on the number of processes."""
+
+
+def fitBatch(times, errors, tauStart, aStart, tol=1e-6, maxIter=50):
+    """Finds the 2D NLL minimum of every dataset in a batch at once, using the same damped Newton steps and stopping rules as Minimiser.bkgNewtonMinimiseNll.
+    Each row of times and errors is one dataset. Returns arrays of tau, a, their errors from the inverse Hessian, whether each fit converged (its gradient is below tol),
+    and whether its line search stalled, finding no lower NLL along the Newton step."""
+
+    funcs = Functions(times, errors, np.mean(errors))
+    size = times.shape[0]
+    roundoff = nllRoundoff(funcs)
+
+    tau = np.full(size, float(tauStart))
+    a = np.full(size, float(aStart))
+    finished = np.zeros(size, dtype=bool) #Datasets which are no longer iterated
+    stalled = np.zeros(size, dtype=bool)
+
+    for iteration in range(maxIter):
+
+        nll, grads, hessian = funcs.bkgNllDerivatives(tau[:, np.newaxis], a[:, np.newaxis])
+        freeGrads, free = freeGradients(a, grads)
+
+        finished |= np.max(np.abs(freeGrads), axis=0) < tol
+        if finished.all():
+            break
+
+        step, descent, uphill = newtonStep(grads, hessian, free)
+        stepTau, stepA = step
+
+        #Datasets where the Newton step promises a decrease below the rounding error of the NLL are also at their minimum
+        rounded = ~finished & ~uphill & atRoundoff(descent, nll, roundoff)
+        last = rounded & (tau + stepTau > 0) & (np.minimum(a + stepA, 1.) > 0) #The line search cannot check so small a decrease, so the final Newton step is taken as it is
+        tau[last] += stepTau[last]
+        a[last] = np.minimum(a[last] + stepA[last], 1.)
+        finished |= rounded
+
+        #Backtracking line search, halving the step of every dataset which has not yet decreased enough
+        t = np.ones(size)
+        searching = ~finished
+        for halving in range(LINE_SEARCH_HALVINGS):
+            trialTau = tau + t*stepTau
+            trialA = np.minimum(a + t*stepA, 1.)
+            valid = searching & (trialTau > 0) & (trialA > 0)
+
+            trialNll = np.full(size, np.inf)
+            trialNll[valid] = funcs.bkgNll(np.where(valid, trialTau, tau)[:, np.newaxis], np.where(valid, trialA, a)[:, np.newaxis])[valid]
+
+            accepted = valid & (trialNll <= nll + SUFFICIENT_DECREASE*(grads[0]*(trialTau - tau) + grads[1]*(trialA - a)))
+            tau[accepted] = trialTau[accepted]
+            a[accepted] = trialA[accepted]
+
+            searching &= ~accepted
+            if not searching.any():
+                break
+            t[searching] *= 0.5
+
+        stalled |= searching #No further decrease can be found along the step, which is reported rather than counted as converged
+        finished |= searching
+
+    nll, grads, hessian = funcs.bkgNllDerivatives(tau[:, np.newaxis], a[:, np.newaxis])
+    converged = np.max(np.abs(freeGradients(a, grads)[0]), axis=0) < tol
+    
+    determinant = hessian[0, 0]*hessian[1, 1] - hessian[0, 1]**2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        tauErrors = np.sqrt(hessian[1, 1]/determinant) #Errors from the diagonal of the inverse Hessian
+        aErrors = np.sqrt(hessian[0, 0]/determinant)
+
+    return tau, a, tauErrors, aErrors, converged, stalled
+
+def makeBatch(random, batchSize, times, errors, tau, a, mode='model'):
+    """Creates a batch of toy datasets, each the same size as the real data.
+    With mode='model' the times are generated from the PDF with background using tau and a, with errors resampled from the real data.
+    With mode='bootstrap' whole (time, error) readings are resampled from the real data with replacement."""
+
+    if mode == 'bootstrap':
+        indices = random.randint(0, len(times), (batchSize, len(times)))
+        return np.asarray(times)[indices], np.asarray(errors)[indices]
+    elif mode == 'model':
+        toyErrors = np.asarray(errors)[random.randint(0, len(errors), (batchSize, len(errors)))]
+        return generateData(None, tau, a, seed=random, errors=toyErrors)
+    else:
+        raise ValueError("mode must be 'model' or 'bootstrap'")
+
+def runBatch(index, seed, batchSize, times, errors, tau, a, mode='model'):
+    """Generates and fits one batch of toys. The random numbers depend only on the seed and the batch index."""
+
+    random = np.random.RandomState([seed, index])
+    toyTimes, toyErrors = makeBatch(random, batchSize, times, errors, tau, a, mode)
+
+    return fitBatch(toyTimes, toyErrors, tau, a)
+
+def runToys(times, errors, tau, a, toys=1000, batchSize=50, mode='model', processes=1, seed=0):
+    """Runs toy pseudo-experiments about the fitted tau and a values (eg. from Minimiser.bkgNewtonMinimiseNll) and returns a dictionary of results.
+    This holds the fitted values, errors and pulls ((fit - true)/error) of tau and a for every toy, together with the mean and width of each pull distribution and the coverage.
+    Only toys whose fits converged are used for the pulls and coverage. Those which did not are flagged in 'converged', and those whose line search stalled in 'stalled'.
+    The coverage is the fraction of toys where the true value lies within the quoted error, which should be near 0.683."""
+
+    batches = [(index, seed, min(batchSize, toys - start), mode) for index, start in enumerate(range(0, toys, batchSize))]
+
+    if processes <= 1:
+        results = [runBatch(index, batchSeed, size, times, errors, tau, a, batchMode) for index, batchSeed, size, batchMode in batches]
+    else:
+        pool = multiprocessing.Pool(processes, _initToyWorker, (times, errors, tau, a)) #The real data is sent once to each worker, rather than with every batch
+        try:
+            results = pool.map(_runBatchInWorker, batches)
+        finally:
+            pool.close()
+            pool.join()
+
+    fitTaus, fitAs, tauErrors, aErrors, converged, stalled = [np.concatenate(values) for values in zip(*results)]
+
+    tauPulls = (fitTaus - tau)/tauErrors
+    aPulls = (fitAs - a)/aErrors
+    good = converged & np.isfinite(tauPulls) & np.isfinite(aPulls)
+
+    return {
+        'tau': fitTaus, 'a': fitAs,
+        'tauErrors': tauErrors, 'aErrors': aErrors,
+        'tauPulls': tauPulls, 'aPulls': aPulls,
+        'converged': converged, 'stalled': stalled,
+        'tauPullMean': np.mean(tauPulls[good]), 'tauPullWidth': np.std(tauPulls[good]),
+        'aPullMean': np.mean(aPulls[good]), 'aPullWidth': np.std(aPulls[good]),
+        'tauCoverage': np.mean(np.abs(tauPulls[good]) < 1), 'aCoverage': np.mean(np.abs(aPulls[good]) < 1),
+    }
+
+_toyData = {} #Real data and fitted values held by each runToys worker process
+
+def _initToyWorker(times, errors, tau, a):
+    """Stores the real data and fitted values in a runToys worker process."""
+
+    _toyData.update(times=times, errors=errors, tau=tau, a=a)
+
+def _runBatchInWorker(args):
+    """Runs one batch of toys inside a runToys worker process."""
+
+    index, seed, batchSize, mode = args
+
+    return runBatch(index, seed, batchSize, _toyData['times'], _toyData['errors'], _toyData['tau'], _toyData['a'], mode)